@@ -2,12 +2,21 @@
 Deal Room Assistant - Streamlit UI for document intelligence
 """
 import streamlit as st
+import io
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+from typing import Optional
 
 # Import AI module
-from deal_room_ai import DealRoomAI
+from deal_room_ai import ChatResponse, DealRoomAI
+from deal_room_cache import ChatHistory, SemanticCache, UploadRegistry
 
 # --- Configuration ---
+# Cached per process: app.py is re-executed on every rerun, so a plain
+# memo defined here would start empty each time
+@st.cache_resource(show_spinner=False)
 def get_config(key: str, default: str = None):
     """Get config from Streamlit secrets or environment variables."""
     try:
@@ -18,8 +27,16 @@ def get_config(key: str, default: str = None):
     return os.getenv(key, default)
 
 MODEL = get_config("GEMINI_MODEL", "gemini-2.5-flash")
+EMBEDDING_MODEL = get_config("EMBEDDING_MODEL", "gemini-embedding-001")
 API_KEY = get_config("GEMINI_API_KEY")
 THINKING_BUDGET = int(get_config("THINKING_BUDGET", "2048"))
+CACHE_DB = get_config("CACHE_DB", "cache.db")
+CHAT_HISTORY_TURNS = int(get_config("CHAT_HISTORY_TURNS", "8"))
+UPLOAD_WORKERS = 4
+MAX_SESSION_MESSAGES = 50
+MAX_SESSION_BYTES = 256 * 1024
+MAX_SESSION_TOTAL_MESSAGES = 500  # across all deal rooms held in one session
+STORE_INFO_TTL = 5  # seconds; also the doc-status polling interval
 
 # --- Initialize AI Client (cached) ---
 @st.cache_resource
@@ -27,24 +44,73 @@ def get_ai_client():
     return DealRoomAI(
         api_key=API_KEY, 
         model=MODEL,
-        thinking_budget=THINKING_BUDGET
+        thinking_budget=THINKING_BUDGET,
+        max_history_turns=CHAT_HISTORY_TURNS,
+        embedding_model=EMBEDDING_MODEL,
+        semantic_cache=SemanticCache(path=CACHE_DB, embedding_model=EMBEDDING_MODEL),
+        upload_registry=UploadRegistry(CACHE_DB)
     )
 
-ai = get_ai_client()
+@st.cache_resource
+def get_chat_history():
+    return ChatHistory(CACHE_DB)
+
+@st.cache_resource
+def get_upload_pool():
+    # Shared by all sessions, so UPLOAD_WORKERS bounds concurrent uploads per process
+    return ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+
+@st.cache_resource
+def get_prefetch_pool():
+    # Shared by all sessions; prefetches are short cache fills
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+chat_history = get_chat_history()
+
+# --- Cached Fetches (plain data only, so results pickle cheaply) ---
+@st.cache_data(ttl=30, show_spinner=False)
+def _fetch_stores() -> tuple[list[str], dict[str, str]]:
+    """Fetch deal room display names (in API order) and a display-to-store-name map."""
+    name_map = {s.display_name or s.name: s.name for s in get_ai_client().list_stores()}
+    return list(name_map), name_map
+
+@st.cache_data(ttl=STORE_INFO_TTL, show_spinner=False)
+def _cached_store_info(store_name: str):
+    """Fetch document counts for a deal room (a small StoreInfo dataclass)."""
+    return get_ai_client().get_store_info(store_name)
+
+def prefetch(store_name: Optional[str]):
+    """
+    Start filling the deal room list and document counts in the background.
+
+    The two fetches run as separate tasks, so their round trips overlap
+    each other and the rest of the render; the script's own calls below
+    wait for an in-flight fill instead of repeating it, and simply hit the
+    cache when it is warm. Skipped until a room is selected, since the
+    counts need a store name. Errors are left for the wrappers below to
+    report.
+    """
+    if store_name is None:
+        return
+    pool = get_prefetch_pool()
+    pool.submit(_fetch_stores)
+    pool.submit(_cached_store_info, store_name)
 
 # --- UI Wrapper Functions (handle errors for Streamlit) ---
-def list_stores():
-    """List all deal rooms."""
+def list_stores() -> tuple[list[str], dict[str, str]]:
+    """List all deal rooms as (display names, display-to-store-name map)."""
     try:
-        return ai.list_stores()
+        return _fetch_stores()
     except Exception as e:
         st.error(f"Error listing deal rooms: {e}")
-        return []
+        return [], {}
 
 def create_store(name: str):
     """Create a new deal room."""
     try:
-        return ai.create_store(name)
+        store = get_ai_client().create_store(name)
+        _fetch_stores.clear()
+        return store
     except Exception as e:
         st.error(f"Error creating deal room: {e}")
         return None
@@ -52,7 +118,9 @@ def create_store(name: str):
 def delete_store(store_name: str):
     """Delete a deal room."""
     try:
-        return ai.delete_store(store_name)
+        deleted = get_ai_client().delete_store(store_name)
+        _fetch_stores.clear()
+        return deleted
     except Exception as e:
         st.error(f"Error deleting deal room: {e}")
         return False
@@ -60,26 +128,179 @@ def delete_store(store_name: str):
 def get_store_info(store_name: str):
     """Get deal room info."""
     try:
-        return ai.get_store_info(store_name)
+        return _cached_store_info(store_name)
     except Exception as e:
         st.error(f"Error getting deal room info: {e}")
         return None
 
-def upload_file(store_name: str, file):
-    """Upload a document to a deal room."""
-    try:
-        return ai.upload_file_bytes(store_name, file.getbuffer(), file.name)
-    except Exception as e:
-        st.error(f"Error uploading document: {e}")
-        return False
+def queue_uploads(store_name: str, files: list):
+    """
+    Start uploading documents to a deal room in the background.
+    
+    Returns immediately; the documents panel polls until every upload for
+    the room has finished and reports the outcome with toasts.
+    """
+    # Workers only touch the AI client; all st.* calls stay on the script thread
+    pool = get_upload_pool()
+    for file in files:
+        # Give each upload its own stream from the start of the buffered file,
+        # so re-clicking Upload never reads from the end or races another worker
+        # (BytesIO shares the bytes from getvalue() rather than copying them)
+        stream = io.BytesIO(file.getvalue())
+        future = pool.submit(get_ai_client().upload_file_stream, store_name, stream, file.name)
+        st.session_state.uploads.append((future, store_name, file.name))
+    st.toast(f"Uploading {pluralize(len(files), 'document')}...")
 
-def chat(store_name: str, message: str, history: list):
-    """Query documents in the deal room."""
+def drain_uploads(store_name: str) -> int:
+    """Report finished background uploads for a deal room; return how many are still running."""
+    running = []
+    indexed = False
+    for upload in st.session_state.uploads:
+        future, upload_store, name = upload
+        if upload_store != store_name or not future.done():
+            running.append(upload)
+            continue
+        try:
+            if future.result():
+                indexed = True
+            else:
+                st.toast(f"{name} is already indexed")
+        except Exception as e:
+            st.toast(f"Error uploading {name}: {e}")
+    st.session_state.uploads = running
+    if indexed:
+        _cached_store_info.clear()
+    return sum(1 for _, upload_store, _ in running if upload_store == store_name)
+
+def compact_messages(messages: list):
+    """
+    Bound a deal room's chat history in place.
+    
+    Keeps the newest MAX_SESSION_MESSAGES messages, fewer if their content
+    exceeds MAX_SESSION_BYTES, and replaces everything older with a single
+    marker message. User/model pairs are dropped together.
+    """
+    start = 1 if messages and messages[0]["role"] == "system" else 0
+    drop = max(0, len(messages) - start - MAX_SESSION_MESSAGES)
+    size = sum(len(m["content"]) for m in messages[start + drop:])
+    while size > MAX_SESSION_BYTES and start + drop < len(messages) - 2:
+        size -= len(messages[start + drop]["content"])
+        drop += 1
+    drop += drop % 2
+    if drop:
+        messages[:start + drop] = [{"role": "system", "content": "Earlier messages were truncated"}]
+
+def get_messages(store_name: str) -> list:
+    """
+    Return a deal room's chat history from session state.
+    
+    The saved conversation is loaded from chat_history the first time a
+    room is opened (from where this session last cleared it), and the room
+    becomes the most recently used.
+    """
+    messages = st.session_state.messages
+    if store_name in messages:
+        messages.move_to_end(store_name)
+    else:
+        # One pair more than is kept, so compact_messages marks the truncation
+        messages[store_name] = chat_history.load(
+            store_name,
+            limit=MAX_SESSION_MESSAGES + 2,
+            after=st.session_state.history_start.get(store_name, 0)
+        )
+        compact_messages(messages[store_name])
+        evict_messages()
+    return messages[store_name]
+
+def evict_messages():
+    """
+    Bound the chat history held in session state across all deal rooms.
+    
+    Drops the least recently opened rooms until at most
+    MAX_SESSION_TOTAL_MESSAGES remain. The current room is never dropped,
+    and dropped rooms reload from chat_history when reopened.
+    """
+    messages = st.session_state.messages
+    total = sum(len(history) for history in messages.values())
+    while total > MAX_SESSION_TOTAL_MESSAGES and len(messages) > 1:
+        _, history = messages.popitem(last=False)
+        total -= len(history)
+
+def chat_stream(store_name: str, message: str, history: list) -> ChatResponse:
+    """Stream an answer into the current container and return the full response."""
     try:
-        response = ai.chat(store_name, message, history)
-        return response.text, response.citations, response.grounding, response.thinking
+        stream = get_ai_client().chat_stream(store_name, message, history)
+        st.write_stream(stream)
+        return stream.response
     except Exception as e:
-        return f"Error: {e}", [], {}, None
+        response = ChatResponse(text=f"Error: {e}", citations=[], grounding={})
+        st.markdown(response.text)
+        return response
+
+# --- HTML Fragments (built once at import) ---
+BRAND_HTML = """
+<div class="brand">
+    <div class="brand-icon">◆</div>
+    <span class="brand-text">Deal Room</span>
+</div>
+<div class="tagline">Due Diligence Assistant</div>
+"""
+
+WELCOME_HTML = """
+<div class="welcome">
+    <div class="welcome-icon">◆</div>
+    <h2>Deal Room Assistant</h2>
+    <p>
+        Upload deal materials — CIMs, financials, legal documents — and ask questions 
+        to accelerate your due diligence and underwriting process.
+    </p>
+    <p style="margin-top: 1rem; font-size: 0.8rem; color: var(--text-muted);">
+        Create a deal room in the sidebar to get started.
+    </p>
+</div>
+"""
+
+NO_DOCUMENTS_HTML = '<p class="empty-state">No documents uploaded</p>'
+
+# Per-item templates for the render loop. Each is a single line, so joined
+# items stay one raw HTML block in markdown. Document- and model-derived
+# values must be passed through html.escape().
+_CITATION_TMPL = '<span class="citation">↗ {}</span>'
+
+_DOC_STATUS_TMPL = '<div class="doc-status"><span class="dot dot-{state}"></span>{label}</div>'
+
+_SUPPORT_TMPL = (
+    '<div style="background: var(--bg-tertiary); padding: 0.5rem 0.75rem; border-radius: 4px; '
+    'margin-bottom: 0.5rem; border-left: 2px solid var(--accent);">'
+    '<span style="font-size: 0.75rem; color: var(--text-muted);">{refs}</span><br>'
+    '<span style="font-size: 0.85rem;">"{text}"</span>'
+    '</div>'
+)
+
+_CHUNK_TMPL = (
+    '<div style="background: var(--bg-tertiary); padding: 0.75rem; border-radius: 6px; margin-bottom: 0.75rem;">'
+    '<div style="font-size: 0.7rem; color: var(--accent); margin-bottom: 0.25rem;">[{number}] {title}</div>'
+    '<div style="font-size: 0.8rem; color: var(--text-secondary); line-height: 1.5; white-space: pre-wrap;">{text}</div>'
+    '</div>'
+)
+
+def pluralize(count: int, word: str) -> str:
+    """Format a count with a regular English noun, e.g. "1 document", "3 documents"."""
+    return f"{count} {word}{'' if count == 1 else 's'}"
+
+def _doc_status_html(active: int, pending: int, failed: int) -> str:
+    """Build the document status block for a deal room's document counts."""
+    if active == 0 and pending == 0:
+        return NO_DOCUMENTS_HTML
+    
+    lines = []
+    if active > 0:
+        lines.append(_DOC_STATUS_TMPL.format(state="ready", label=f"{pluralize(active, 'document')} ready"))
+    if pending > 0:
+        lines.append(_DOC_STATUS_TMPL.format(state="pending", label=f"{pending} processing"))
+    if failed > 0:
+        lines.append(_DOC_STATUS_TMPL.format(state="failed", label=f"{failed} failed"))
+    return "\n".join(lines)
 
 # --- Page Config ---
 st.set_page_config(
@@ -89,375 +310,48 @@ st.set_page_config(
 )
 
 # --- Custom CSS ---
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=IBM+Plex+Sans:wght@400;500;600&family=IBM+Plex+Mono:wght@400;500&display=swap');
-    
-    :root {
-        --bg-primary: #0f1419;
-        --bg-secondary: #1a1f26;
-        --bg-tertiary: #242b33;
-        --accent: #3b82f6;
-        --accent-hover: #2563eb;
-        --accent-dim: rgba(59, 130, 246, 0.15);
-        --success: #10b981;
-        --warning: #f59e0b;
-        --error: #ef4444;
-        --text-primary: #f1f5f9;
-        --text-secondary: #94a3b8;
-        --text-muted: #64748b;
-        --border: #2d3748;
-        --border-light: #3d4a5c;
-    }
-    
-    * {
-        font-family: 'IBM Plex Sans', -apple-system, BlinkMacSystemFont, sans-serif !important;
-    }
-    
-    .stApp {
-        background: var(--bg-primary);
-    }
-    
-    /* Hide all sidebar toggle/collapse buttons */
-    [data-testid="collapsedControl"],
-    [data-testid="stSidebarCollapsedControl"],
-    button[kind="headerNoPadding"],
-    [data-testid="baseButton-headerNoPadding"],
-    .st-emotion-cache-1egp75f,
-    [aria-label="Collapse sidebar"],
-    [aria-label="Expand sidebar"] {
-        display: none !important;
-        visibility: hidden !important;
-        width: 0 !important;
-        height: 0 !important;
-        overflow: hidden !important;
-    }
-    
-    /* Typography */
-    h1, h2, h3, h4 {
-        font-weight: 600 !important;
-        color: var(--text-primary) !important;
-    }
-    
-    .brand {
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-        margin-bottom: 0.25rem;
-    }
-    
-    .brand-icon {
-        width: 32px;
-        height: 32px;
-        background: linear-gradient(135deg, var(--accent), #8b5cf6);
-        border-radius: 8px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-size: 1rem;
-        color: white;
-    }
-    
-    .brand-text {
-        font-size: 1.1rem;
-        font-weight: 600;
-        color: var(--text-primary);
-        letter-spacing: -0.02em;
-    }
-    
-    .tagline {
-        font-size: 0.75rem;
-        color: var(--text-muted);
-        margin-bottom: 1.5rem;
-        font-family: 'IBM Plex Mono', monospace !important;
-    }
-    
-    /* Sidebar */
-    section[data-testid="stSidebar"] {
-        background: var(--bg-secondary);
-        border-right: 1px solid var(--border);
-    }
-    
-    section[data-testid="stSidebar"] > div {
-        padding-top: 1.5rem;
-    }
-    
-    /* Form labels */
-    .stSelectbox label, .stTextInput label {
-        font-size: 0.7rem !important;
-        font-weight: 500 !important;
-        color: var(--text-muted) !important;
-        text-transform: uppercase;
-        letter-spacing: 0.05em;
-        margin-bottom: 0.5rem !important;
-    }
-    
-    /* Input fields - improved visibility */
-    .stTextInput input {
-        background: var(--bg-tertiary) !important;
-        border: 1px solid var(--border-light) !important;
-        border-radius: 6px !important;
-        color: var(--text-primary) !important;
-        font-size: 0.9rem !important;
-        padding: 0.6rem 0.75rem !important;
-    }
-    
-    .stTextInput input::placeholder {
-        color: var(--text-muted) !important;
-    }
-    
-    .stTextInput input:focus {
-        border-color: var(--accent) !important;
-        box-shadow: 0 0 0 2px var(--accent-dim) !important;
-    }
-    
-    /* Select boxes */
-    .stSelectbox > div > div {
-        background: var(--bg-tertiary) !important;
-        border: 1px solid var(--border-light) !important;
-        border-radius: 6px !important;
-    }
-    
-    /* Buttons */
-    .stButton > button {
-        font-family: 'IBM Plex Sans', sans-serif !important;
-        font-weight: 500 !important;
-        font-size: 0.85rem !important;
-        border-radius: 6px !important;
-        padding: 0.5rem 1rem !important;
-        transition: all 0.15s ease !important;
-    }
-    
-    .stButton > button[data-testid="baseButton-primary"] {
-        background: var(--accent) !important;
-        border: none !important;
-    }
-    
-    .stButton > button[data-testid="baseButton-primary"]:hover {
-        background: var(--accent-hover) !important;
-    }
-    
-    .stButton > button[data-testid="baseButton-secondary"] {
-        background: transparent !important;
-        border: 1px solid var(--border-light) !important;
-        color: var(--text-secondary) !important;
-    }
-    
-    .stButton > button[data-testid="baseButton-secondary"]:hover {
-        background: var(--bg-tertiary) !important;
-        border-color: var(--text-muted) !important;
-    }
-    
-    /* Section label */
-    .section-label {
-        font-size: 0.7rem;
-        font-weight: 500;
-        color: var(--text-muted);
-        text-transform: uppercase;
-        letter-spacing: 0.05em;
-        margin-bottom: 0.75rem;
-    }
-    
-    /* Card */
-    .card {
-        background: var(--bg-secondary);
-        border: 1px solid var(--border);
-        border-radius: 8px;
-        padding: 1rem;
-    }
-    
-    /* Document status */
-    .doc-status {
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-        padding: 0.5rem 0.75rem;
-        background: var(--bg-tertiary);
-        border-radius: 6px;
-        font-size: 0.8rem;
-        color: var(--text-secondary);
-        margin-bottom: 0.5rem;
-        font-family: 'IBM Plex Mono', monospace !important;
-    }
-    
-    .doc-status .dot {
-        width: 6px;
-        height: 6px;
-        border-radius: 50%;
-    }
-    
-    .dot-ready { background: var(--success); }
-    .dot-pending { background: var(--warning); }
-    .dot-failed { background: var(--error); }
-    
-    /* Citation */
-    .citation {
-        display: inline-flex;
-        align-items: center;
-        gap: 0.25rem;
-        background: var(--accent-dim);
-        border: 1px solid rgba(59, 130, 246, 0.3);
-        border-radius: 4px;
-        padding: 0.2rem 0.5rem;
-        margin: 0.2rem 0.2rem 0.2rem 0;
-        font-family: 'IBM Plex Mono', monospace !important;
-        font-size: 0.7rem;
-        color: var(--accent);
-    }
-    
-    /* Chat */
-    .stChatMessage {
-        background: var(--bg-secondary) !important;
-        border: 1px solid var(--border) !important;
-        border-radius: 8px !important;
-    }
-    
-    .stChatInput > div {
-        background: var(--bg-secondary) !important;
-        border: 1px solid var(--border-light) !important;
-        border-radius: 8px !important;
-    }
-    
-    .stChatInput input {
-        color: var(--text-primary) !important;
-    }
-    
-    /* File uploader */
-    [data-testid="stFileUploader"] {
-        background: var(--bg-secondary) !important;
-        border: 1px dashed var(--border-light) !important;
-        border-radius: 8px !important;
-        padding: 1rem !important;
-    }
-    
-    [data-testid="stFileUploader"]:hover {
-        border-color: var(--accent) !important;
-    }
-    
-    /* Divider */
-    hr {
-        border-color: var(--border) !important;
-        margin: 1rem 0 !important;
-    }
-    
-    /* Empty state */
-    .empty-state {
-        text-align: center;
-        padding: 2rem 1rem;
-        color: var(--text-muted);
-        font-size: 0.85rem;
-    }
-    
-    /* Welcome */
-    .welcome {
-        text-align: center;
-        padding: 4rem 2rem;
-        max-width: 480px;
-        margin: 0 auto;
-    }
-    
-    .welcome-icon {
-        width: 64px;
-        height: 64px;
-        background: linear-gradient(135deg, var(--accent), #8b5cf6);
-        border-radius: 16px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-size: 1.5rem;
-        color: white;
-        margin: 0 auto 1.5rem;
-    }
-    
-    .welcome h2 {
-        font-size: 1.5rem;
-        margin-bottom: 0.75rem;
-    }
-    
-    .welcome p {
-        color: var(--text-secondary);
-        font-size: 0.9rem;
-        line-height: 1.6;
-    }
-    
-    /* Config card */
-    .config-card {
-        background: var(--bg-tertiary);
-        border-radius: 6px;
-        padding: 0.75rem;
-        font-family: 'IBM Plex Mono', monospace !important;
-        font-size: 0.7rem;
-        color: var(--text-muted);
-    }
-    
-    /* Grounding toggle checkbox */
-    .stChatMessage .stCheckbox {
-        margin-top: 0.5rem !important;
-    }
-    
-    .stChatMessage .stCheckbox label {
-        font-size: 0.75rem !important;
-        color: var(--text-muted) !important;
-        font-family: 'IBM Plex Mono', monospace !important;
-    }
-    
-    .stChatMessage .stCheckbox label:hover {
-        color: var(--accent) !important;
-    }
-    
-    .stChatMessage .stCheckbox [data-testid="stCheckbox"] {
-        background: transparent !important;
-    }
-    
-    /* Grounding info box */
-    .grounding-info {
-        background: rgba(59, 130, 246, 0.1);
-        border: 1px solid rgba(59, 130, 246, 0.2);
-        border-radius: 6px;
-        padding: 0.75rem;
-        margin-bottom: 0.75rem;
-        font-size: 0.75rem;
-        color: var(--text-secondary);
-        line-height: 1.5;
-    }
-    
-    .grounding-info strong {
-        color: var(--accent);
-    }
-    
-    /* Scrollbar */
-    ::-webkit-scrollbar { width: 6px; }
-    ::-webkit-scrollbar-track { background: var(--bg-primary); }
-    ::-webkit-scrollbar-thumb { background: var(--border); border-radius: 3px; }
-    ::-webkit-scrollbar-thumb:hover { background: var(--border-light); }
-</style>
-""", unsafe_allow_html=True)
+# static/app.css is served by Streamlit (server.enableStaticServing) and cached
+# by the browser, so reruns only resend this one-line tag. Streamlit < 1.56
+# serves .css static files as text/plain, which browsers refuse as a
+# stylesheet; requirements.txt pins the floor accordingly.
+STYLESHEET_HTML = '<link rel="stylesheet" href="./app/static/app.css">'
+
+st.markdown(STYLESHEET_HTML, unsafe_allow_html=True)
+
+# Nothing below works without a key; stop before building the client
+if not API_KEY:
+    st.error("Configure GEMINI_API_KEY in Streamlit secrets or the environment to get started.")
+    st.stop()
 
 # --- Session State ---
 if "messages" not in st.session_state:
-    st.session_state.messages = {}
+    # Per-store histories, least recently opened first (see get_messages)
+    st.session_state.messages = OrderedDict()
 
 if "current_store" not in st.session_state:
     st.session_state.current_store = None
 
-# --- Sidebar ---
-with st.sidebar:
-    st.markdown("""
-    <div class="brand">
-        <div class="brand-icon">◆</div>
-        <span class="brand-text">Deal Room</span>
-    </div>
-    <div class="tagline">Due Diligence Assistant</div>
-    """, unsafe_allow_html=True)
+# Per-store sequence number this session's chat history starts after (see clear_chat)
+if "history_start" not in st.session_state:
+    st.session_state.history_start = {}
+
+# Background uploads as (future, store name, filename)
+if "uploads" not in st.session_state:
+    st.session_state.uploads = []
+
+# --- Sidebar (fragment: its widgets rerun only the sidebar) ---
+@st.fragment
+def render_sidebar():
+    st.markdown(BRAND_HTML, unsafe_allow_html=True)
     
     # List existing deal rooms
-    stores = list_stores()
-    store_options = {s.display_name or s.name: s.name for s in stores}
+    store_displays, store_options = list_stores()
+    previous_store = st.session_state.current_store
     
     if store_options:
         selected_display = st.selectbox(
             "ACTIVE DEAL ROOM",
-            options=list(store_options.keys()),
+            options=store_displays,
             index=0
         )
         st.session_state.current_store = store_options[selected_display]
@@ -465,16 +359,23 @@ with st.sidebar:
         st.markdown('<p class="empty-state">No deal rooms yet</p>', unsafe_allow_html=True)
         st.session_state.current_store = None
     
+    # Switching rooms changes the main content, so rerun the whole app
+    if previous_store is not None and st.session_state.current_store != previous_store:
+        st.rerun()
+    
     st.divider()
     
     # Create new deal room
     st.markdown('<div class="section-label">New Deal Room</div>', unsafe_allow_html=True)
-    new_store_name = st.text_input(
-        "Deal room name",
-        placeholder="e.g., Acme Corp Acquisition",
-        label_visibility="collapsed"
-    )
-    if st.button("Create", use_container_width=True, type="primary"):
+    # A form submits once on Create instead of rerunning on every edit
+    with st.form("new_store", clear_on_submit=True, border=False):
+        new_store_name = st.text_input(
+            "Deal room name",
+            placeholder="e.g., Acme Corp Acquisition",
+            label_visibility="collapsed"
+        )
+        submitted = st.form_submit_button("Create", use_container_width=True, type="primary")
+    if submitted:
         if new_store_name:
             with st.spinner("Creating deal room..."):
                 store = create_store(new_store_name)
@@ -491,6 +392,7 @@ with st.sidebar:
             if delete_store(st.session_state.current_store):
                 if st.session_state.current_store in st.session_state.messages:
                     del st.session_state.messages[st.session_state.current_store]
+                chat_history.forget_store(st.session_state.current_store)
                 st.session_state.current_store = None
                 st.rerun()
     
@@ -498,217 +400,222 @@ with st.sidebar:
     st.divider()
     st.markdown(f'<div class="config-card">Model: {MODEL}</div>', unsafe_allow_html=True)
 
+# --- Documents Panel (fragment: uploads rerun only this panel) ---
+@st.fragment
+def render_documents(store_name: str):
+    st.markdown("#### Documents")
+    
+    uploaded_files = st.file_uploader(
+        "Upload deal materials",
+        type=["txt", "pdf", "md", "json", "csv", "docx", "xlsx", "html"],
+        accept_multiple_files=True,
+        label_visibility="collapsed",
+        help="CIMs, financials, legal docs, memos"
+    )
+    
+    if uploaded_files:
+        if st.button("Upload", use_container_width=True, type="primary"):
+            queue_uploads(store_name, uploaded_files)
+    
+    st.markdown("---")
+    st.markdown('<div class="section-label">Indexed Documents</div>', unsafe_allow_html=True)
+    
+    inflight = drain_uploads(store_name)
+    store_info = get_store_info(store_name)
+    
+    if inflight or (store_info and store_info.pending_documents_count):
+        poll_doc_status(store_name)
+    else:
+        render_doc_status(store_info)
+
+def render_doc_status(store_info):
+    """Render the active/pending/failed document counts."""
+    if store_info:
+        status_html = _doc_status_html(
+            store_info.active_documents_count,
+            store_info.pending_documents_count,
+            store_info.failed_documents_count
+        )
+    else:
+        status_html = _doc_status_html(0, 0, 0)
+    st.markdown(status_html, unsafe_allow_html=True)
+
+# --- Indexing Poller (fragment: repaints only the counts while uploading or indexing) ---
+@st.fragment(run_every=STORE_INFO_TTL)
+def poll_doc_status(store_name: str):
+    inflight = drain_uploads(store_name)
+    store_info = get_store_info(store_name)
+    render_doc_status(store_info)
+    if inflight:
+        st.caption(f"Uploading {pluralize(inflight, 'document')}...")
+    
+    # Everything finished: rerun the app so the static panel replaces the poller
+    if not inflight and (not store_info or not store_info.pending_documents_count):
+        st.rerun()
+
+prefetch(st.session_state.current_store)
+
+with st.sidebar:
+    render_sidebar()
+
+# --- Chat Messages ---
+def render_message_details(msg: dict):
+    """Render a model message's citations, reasoning and source passages."""
+    if msg.get("citations"):
+        citation_html = "".join(map(_CITATION_TMPL.format, map(escape, msg["citations"])))
+        st.markdown(f"<div style='margin-top: 0.5rem;'>{citation_html}</div>", unsafe_allow_html=True)
+    
+    # Model's thinking/reasoning (collapsible). Expanders toggle in the
+    # browser, so opening one does not rerun the script.
+    if msg.get("thinking"):
+        with st.expander("🧠 View reasoning process"):
+            st.markdown("""
+            <div class="grounding-info">
+                <strong>Model's reasoning:</strong> This shows how the AI analyzed the retrieved documents 
+                and reasoned through the question before generating its response.
+            </div>
+            """, unsafe_allow_html=True)
+            st.markdown(f"""
+            <div style="background: var(--bg-tertiary); padding: 0.75rem; border-radius: 6px; 
+                        font-size: 0.8rem; color: var(--text-secondary); line-height: 1.6;
+                        white-space: pre-wrap; font-family: 'IBM Plex Mono', monospace;">
+{escape(msg["thinking"])}
+            </div>
+            """, unsafe_allow_html=True)
+    
+    # Grounding details (collapsible)
+    if msg.get("grounding") and msg["grounding"].get("chunks"):
+        grounding = msg["grounding"]
+        with st.expander("🔍 View source passages"):
+            # Info box explaining the section
+            st.markdown("""
+            <div class="grounding-info">
+                <strong>About this section:</strong> This shows how the answer was grounded in your documents. 
+                <strong>Grounded statements</strong> show which parts of the response came from specific passages (marked [1], [2], etc). 
+                <strong>Retrieved passages</strong> are the actual text excerpts from your documents that were used to generate the answer.
+            </div>
+            """, unsafe_allow_html=True)
+            
+            # Show which parts of the answer came from which chunks
+            if grounding.get("supports"):
+                st.markdown("**Grounded statements:**")
+                support_html = "\n".join(
+                    _SUPPORT_TMPL.format(
+                        refs=", ".join([f"[{i+1}]" for i in support["chunk_indices"]]),
+                        text=escape(support["text"])
+                    )
+                    for support in grounding["supports"]
+                )
+                st.markdown(support_html, unsafe_allow_html=True)
+                st.markdown("---")
+            
+            # Show retrieved chunks
+            st.markdown("**Retrieved passages:**")
+            chunk_html = "\n".join(
+                _CHUNK_TMPL.format(
+                    number=chunk["index"] + 1,
+                    title=escape(chunk["title"]),
+                    text=escape(chunk["text"]) if chunk["text"] else "No text available"
+                )
+                for chunk in grounding["chunks"]
+            )
+            st.markdown(chunk_html, unsafe_allow_html=True)
+
+def clear_chat(store_name: str):
+    """
+    Clear a deal room's conversation for this session.
+
+    The shared transcript is kept, since other sessions may have the room
+    open; this session just stops loading messages older than now.
+    """
+    st.session_state.messages[store_name] = []
+    st.session_state.history_start[store_name] = chat_history.last_seq(store_name)
+
+# --- Chat (fragment: a new message reruns only the conversation) ---
+@st.fragment
+def render_chat(store_name: str):
+    st.markdown("#### Ask about this deal")
+    
+    messages = get_messages(store_name)
+    
+    chat_container = st.container(height=480)
+    
+    with chat_container:
+        empty_state = st.empty()
+        if not messages:
+            empty_state.markdown('''
+            <p class="empty-state">
+                Ask questions about the deal materials.<br>
+                <span style="font-size: 0.75rem; opacity: 0.7;">
+                    e.g., "Summarize the key financial metrics" or "What are the main risks?"
+                </span>
+            </p>
+            ''', unsafe_allow_html=True)
+        
+        for msg in messages:
+            if msg["role"] == "system":
+                st.markdown(f'<p class="empty-state">{msg["content"]}</p>', unsafe_allow_html=True)
+                continue
+            avatar = "👤" if msg["role"] == "user" else "🔷"
+            with st.chat_message(msg["role"], avatar=avatar):
+                st.markdown(msg["content"])
+                render_message_details(msg)
+    
+    if prompt := st.chat_input("Ask about the deal materials..."):
+        messages.append({"role": "user", "content": prompt})
+        
+        # Render the new exchange in place rather than rerunning, so the
+        # earlier messages are not emitted a second time
+        empty_state.empty()
+        with chat_container:
+            with st.chat_message("user", avatar="👤"):
+                st.markdown(prompt)
+            
+            with st.chat_message("model", avatar="🔷"):
+                with st.spinner("Analyzing documents..."):
+                    response = chat_stream(
+                        store_name,
+                        prompt,
+                        messages[:-1]
+                    )
+                reply = {
+                    "role": "model",
+                    "content": response.text,
+                    "citations": response.citations,
+                    "grounding": response.grounding,
+                    "thinking": response.thinking
+                }
+                render_message_details(reply)
+        
+        messages.append(reply)
+        # Append only this exchange, so concurrent sessions never clobber each other
+        chat_history.append(store_name, messages[-2:])
+        compact_messages(messages)
+        evict_messages()
+    
+    if messages:
+        col_a, col_b = st.columns([3, 1])
+        with col_b:
+            # Runs before the rerun the click triggers, so no explicit rerun is needed
+            st.button(
+                "Clear",
+                use_container_width=True,
+                type="secondary",
+                on_click=clear_chat,
+                args=(store_name,)
+            )
+
 # --- Main Content ---
 if st.session_state.current_store:
     col1, col2 = st.columns([1, 2.5])
     
     # --- Left Column: Documents ---
     with col1:
-        st.markdown("#### Documents")
-        
-        uploaded_file = st.file_uploader(
-            "Upload deal materials",
-            type=["txt", "pdf", "md", "json", "csv", "docx", "xlsx", "html"],
-            label_visibility="collapsed",
-            help="CIMs, financials, legal docs, memos"
-        )
-        
-        if uploaded_file:
-            if st.button("Upload", use_container_width=True, type="primary"):
-                with st.spinner(f"Processing {uploaded_file.name}..."):
-                    if upload_file(st.session_state.current_store, uploaded_file):
-                        st.success("Document indexed")
-                        st.rerun()
-        
-        st.markdown("---")
-        st.markdown('<div class="section-label">Indexed Documents</div>', unsafe_allow_html=True)
-        
-        store_info = get_store_info(st.session_state.current_store)
-        
-        if store_info:
-            active = store_info.active_documents_count
-            pending = store_info.pending_documents_count
-            failed = store_info.failed_documents_count
-            
-            if active > 0 or pending > 0:
-                if active > 0:
-                    st.markdown(f'''
-                    <div class="doc-status">
-                        <span class="dot dot-ready"></span>
-                        {active} document{"s" if active != 1 else ""} ready
-                    </div>
-                    ''', unsafe_allow_html=True)
-                
-                if pending > 0:
-                    st.markdown(f'''
-                    <div class="doc-status">
-                        <span class="dot dot-pending"></span>
-                        {pending} processing
-                    </div>
-                    ''', unsafe_allow_html=True)
-                
-                if failed > 0:
-                    st.markdown(f'''
-                    <div class="doc-status">
-                        <span class="dot dot-failed"></span>
-                        {failed} failed
-                    </div>
-                    ''', unsafe_allow_html=True)
-            else:
-                st.markdown('<p class="empty-state">No documents uploaded</p>', unsafe_allow_html=True)
-        else:
-            st.markdown('<p class="empty-state">No documents uploaded</p>', unsafe_allow_html=True)
+        render_documents(st.session_state.current_store)
     
     # --- Right Column: Chat ---
     with col2:
-        st.markdown("#### Ask about this deal")
-        
-        if st.session_state.current_store not in st.session_state.messages:
-            st.session_state.messages[st.session_state.current_store] = []
-        
-        messages = st.session_state.messages[st.session_state.current_store]
-        
-        chat_container = st.container(height=480)
-        
-        with chat_container:
-            if not messages:
-                st.markdown('''
-                <p class="empty-state">
-                    Ask questions about the deal materials.<br>
-                    <span style="font-size: 0.75rem; opacity: 0.7;">
-                        e.g., "Summarize the key financial metrics" or "What are the main risks?"
-                    </span>
-                </p>
-                ''', unsafe_allow_html=True)
-            
-            for msg in messages:
-                avatar = "👤" if msg["role"] == "user" else "🔷"
-                with st.chat_message(msg["role"], avatar=avatar):
-                    st.markdown(msg["content"])
-                    if msg.get("citations"):
-                        citation_html = "".join([
-                            f'<span class="citation">↗ {c}</span>' 
-                            for c in msg["citations"]
-                        ])
-                        st.markdown(f"<div style='margin-top: 0.5rem;'>{citation_html}</div>", unsafe_allow_html=True)
-                    
-                    # Model's thinking/reasoning (collapsible)
-                    if msg.get("thinking"):
-                        msg_idx = messages.index(msg)
-                        thinking_key = f"thinking_{st.session_state.current_store}_{msg_idx}"
-                        
-                        show_thinking = st.checkbox(
-                            "🧠 View reasoning process",
-                            key=thinking_key,
-                            value=False
-                        )
-                        
-                        if show_thinking:
-                            st.markdown("""
-                            <div class="grounding-info">
-                                <strong>Model's reasoning:</strong> This shows how the AI analyzed the retrieved documents 
-                                and reasoned through the question before generating its response.
-                            </div>
-                            """, unsafe_allow_html=True)
-                            st.markdown(f"""
-                            <div style="background: var(--bg-tertiary); padding: 0.75rem; border-radius: 6px; 
-                                        font-size: 0.8rem; color: var(--text-secondary); line-height: 1.6;
-                                        white-space: pre-wrap; font-family: 'IBM Plex Mono', monospace;">
-{msg["thinking"]}
-                            </div>
-                            """, unsafe_allow_html=True)
-                    
-                    # Grounding details (collapsible via checkbox)
-                    if msg.get("grounding") and msg["grounding"].get("chunks"):
-                        grounding = msg["grounding"]
-                        msg_idx = messages.index(msg)
-                        toggle_key = f"grounding_{st.session_state.current_store}_{msg_idx}"
-                        
-                        show_grounding = st.checkbox(
-                            "🔍 View source passages",
-                            key=toggle_key,
-                            value=False
-                        )
-                        
-                        if show_grounding:
-                            # Info box explaining the section
-                            st.markdown("""
-                            <div class="grounding-info">
-                                <strong>About this section:</strong> This shows how the answer was grounded in your documents. 
-                                <strong>Grounded statements</strong> show which parts of the response came from specific passages (marked [1], [2], etc). 
-                                <strong>Retrieved passages</strong> are the actual text excerpts from your documents that were used to generate the answer.
-                            </div>
-                            """, unsafe_allow_html=True)
-                            
-                            # Show which parts of the answer came from which chunks
-                            if grounding.get("supports"):
-                                st.markdown("**Grounded statements:**")
-                                for support in grounding["supports"]:
-                                    chunk_refs = ", ".join([f"[{i+1}]" for i in support["chunk_indices"]])
-                                    st.markdown(f"""
-                                    <div style="background: var(--bg-tertiary); padding: 0.5rem 0.75rem; border-radius: 4px; margin-bottom: 0.5rem; border-left: 2px solid var(--accent);">
-                                        <span style="font-size: 0.75rem; color: var(--text-muted);">{chunk_refs}</span><br>
-                                        <span style="font-size: 0.85rem;">"{support['text']}"</span>
-                                    </div>
-                                    """, unsafe_allow_html=True)
-                                st.markdown("---")
-                            
-                            # Show retrieved chunks
-                            st.markdown("**Retrieved passages:**")
-                            for chunk in grounding["chunks"]:
-                                st.markdown(f"""
-                                <div style="background: var(--bg-tertiary); padding: 0.75rem; border-radius: 6px; margin-bottom: 0.75rem;">
-                                    <div style="font-size: 0.7rem; color: var(--accent); margin-bottom: 0.25rem;">
-                                        [{chunk['index']+1}] {chunk['title']}
-                                    </div>
-                                    <div style="font-size: 0.8rem; color: var(--text-secondary); line-height: 1.5; white-space: pre-wrap;">
-{chunk['text'] if chunk['text'] else 'No text available'}
-                                    </div>
-                                </div>
-                                """, unsafe_allow_html=True)
-        
-        if prompt := st.chat_input("Ask about the deal materials..."):
-            messages.append({"role": "user", "content": prompt})
-            
-            with chat_container:
-                with st.chat_message("user", avatar="👤"):
-                    st.markdown(prompt)
-            
-            with st.spinner("Analyzing documents..."):
-                response_text, citations, grounding_details, thinking = chat(
-                    st.session_state.current_store,
-                    prompt,
-                    messages[:-1]
-                )
-            
-            messages.append({
-                "role": "model",
-                "content": response_text,
-                "citations": citations,
-                "grounding": grounding_details,
-                "thinking": thinking
-            })
-            
-            st.rerun()
-        
-        if messages:
-            col_a, col_b = st.columns([3, 1])
-            with col_b:
-                if st.button("Clear", use_container_width=True, type="secondary"):
-                    st.session_state.messages[st.session_state.current_store] = []
-                    st.rerun()
+        render_chat(st.session_state.current_store)
 
 else:
-    st.markdown("""
-    <div class="welcome">
-        <div class="welcome-icon">◆</div>
-        <h2>Deal Room Assistant</h2>
-        <p>
-            Upload deal materials — CIMs, financials, legal documents — and ask questions 
-            to accelerate your due diligence and underwriting process.
-        </p>
-        <p style="margin-top: 1rem; font-size: 0.8rem; color: var(--text-muted);">
-            Create a deal room in the sidebar to get started.
-        </p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(WELCOME_HTML, unsafe_allow_html=True)
@@ -3,14 +3,55 @@ Deal Room AI - Core AI/LLM logic for document intelligence
 
 This module contains all Google GenAI / File Search related functionality,
 separated from the UI layer for easy integration into production APIs.
+
+The google-genai SDK is imported lazily (on first client construction or
+request), so the prompt, dataclasses, and caches can be imported without
+paying the SDK's import cost.
 """
-from google import genai
-from google.genai import types
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import mimetypes
 import time
 import os
-import uuid
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Optional
+from functools import lru_cache
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterator, Literal, Optional
+
+if TYPE_CHECKING:
+    from google.genai import types
+    from deal_room_cache import SemanticCache, UploadRegistry
+
+
+logger = logging.getLogger(__name__)
+
+# Read/write size when spooling uploads to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Status checks the upload poller runs at once when several operations are due
+POLL_CONCURRENCY = 8
+
+# Question embeddings kept per client, so re-asked questions skip the embedding call
+EMBEDDING_CACHE_SIZE = 256
+
+# Request configs kept per client, keyed by (store, system prompt, thinking budget)
+CONFIG_CACHE_SIZE = 32
+
+# Thinking budgets by query type: short factual lookups skip reasoning,
+# open-ended synthesis lets the model decide
+BudgetProfile = Literal["fast", "balanced", "deep"]
+THINKING_BUDGET_PROFILES: dict[str, int] = {"fast": 0, "balanced": 2048, "deep": -1}
+
+# genai.Client instances shared across DealRoomAI instances, keyed by API key
+_CLIENT_CACHE: dict = {}
+_CLIENT_CACHE_LOCK = threading.Lock()
 
 
 # --- System Prompt for PE Due Diligence ---
@@ -104,7 +145,24 @@ If your initial search doesn't surface relevant information:
 - **Intellectual honesty** — Distinguish between what you know vs. what you're inferring"""
 
 
-@dataclass
+# --- Query Decomposition Prompts ---
+# Cheap model used to split complex questions; answers still come from the chat model
+DECOMPOSITION_MODEL = "gemini-2.5-flash-lite"
+
+DECOMPOSITION_PROMPT = """Break the due diligence question below into at most {k} self-contained sub-questions that can each be answered independently from the deal documents. Cover every distinct angle the question asks about (e.g. financials, operations, market, management, risks). If the question is already narrow, return it unchanged as the only item.
+
+Return a JSON list of strings and nothing else.
+
+Question: {question}"""
+
+SYNTHESIS_PROMPT = """Answer the original question using the research findings below. Each finding answers one sub-question and was drawn from the deal documents. Combine them into a single structured answer, resolve overlaps, and keep every number, source reference, and "Not found in available documents" caveat exactly as stated. Do not add facts that are not in the findings.
+
+Original question: {question}
+
+{findings}"""
+
+
+@dataclass(slots=True)
 class ChatResponse:
     """Response from a chat query."""
     text: str
@@ -113,7 +171,7 @@ class ChatResponse:
     thinking: Optional[str] = None  # Model's thinking/reasoning if available
 
 
-@dataclass
+@dataclass(slots=True)
 class StoreInfo:
     """Information about a deal room/store."""
     name: str
@@ -144,6 +202,12 @@ class DealRoomAI:
         print(response.text)
         print(response.citations)
         print(response.thinking)  # Model's reasoning process
+        
+        # Stream the answer as it is generated
+        stream = ai.chat_stream(store.name, "Summarize the CIM")
+        for delta in stream:
+            print(delta, end="")
+        print(stream.response.citations)
     """
     
     def __init__(
@@ -151,7 +215,11 @@ class DealRoomAI:
         api_key: Optional[str] = None, 
         model: str = "gemini-2.5-flash",
         system_prompt: Optional[str] = None,
-        thinking_budget: int = -1
+        thinking_budget: int = -1,
+        semantic_cache: Optional["SemanticCache"] = None,
+        embedding_model: str = "gemini-embedding-001",
+        max_history_turns: Optional[int] = 8,
+        upload_registry: Optional["UploadRegistry"] = None
     ):
         """
         Initialize the AI client.
@@ -163,15 +231,31 @@ class DealRoomAI:
             thinking_budget: Token budget for model thinking/reasoning.
                            0 = disabled, -1 = dynamic, >0 = fixed budget.
                            Default: 2048
+            semantic_cache: Optional SemanticCache. When set, near-duplicate
+                           questions in the same deal room reuse a cached answer
+                           until the room's documents change.
+            embedding_model: Model used to embed questions for the semantic cache.
+                           Default: gemini-embedding-001
+            max_history_turns: Number of most recent user/model exchanges sent
+                           as context. None = full history. Default: 8
+            upload_registry: Optional UploadRegistry. When set, re-uploads of
+                           identical content to the same deal room are skipped.
         """
         self.model = model
         self.system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
         self.thinking_budget = thinking_budget
+        self.semantic_cache = semantic_cache
+        self.embedding_model = embedding_model
+        self.max_history_turns = max_history_turns
+        self.upload_registry = upload_registry
         
-        if api_key:
-            self.client = genai.Client(api_key=api_key)
-        else:
-            self.client = genai.Client()
+        self.client = _shared_client(api_key)
+        self._poller = _OperationPoller(self.client)
+        # Embeddings are stored as float32 arrays (~3 KB each)
+        self._embeddings: OrderedDict[str, array] = OrderedDict()
+        self._embeddings_lock = threading.Lock()
+        self._configs: OrderedDict[tuple, "types.GenerateContentConfig"] = OrderedDict()
+        self._configs_lock = threading.Lock()
     
     def list_stores(self) -> list:
         """
@@ -214,6 +298,9 @@ class DealRoomAI:
             Exception: If the API call fails.
         """
         self.client.file_search_stores.delete(name=store_name, config={"force": True})
+        if self.upload_registry:
+            self.upload_registry.forget_store(store_name)
+        self._documents_changed(store_name)
         return True
     
     def get_store_info(self, store_name: str) -> Optional[StoreInfo]:
@@ -229,21 +316,16 @@ class DealRoomAI:
         Raises:
             Exception: If the API call fails.
         """
-        store = self.client.file_search_stores.get(name=store_name)
-        return StoreInfo(
-            name=store.name,
-            display_name=store.display_name,
-            active_documents_count=int(store.active_documents_count or 0),
-            pending_documents_count=int(store.pending_documents_count or 0),
-            failed_documents_count=int(store.failed_documents_count or 0),
-        )
+        return _to_store_info(self.client.file_search_stores.get(name=store_name))
     
     def upload_file(
         self, 
         store_name: str, 
         file_path: str, 
         display_name: Optional[str] = None,
-        poll_interval: float = 1.0
+        poll_interval: float = 0.1,
+        max_poll_interval: float = 2.0,
+        timeout: Optional[float] = None
     ) -> bool:
         """
         Upload a document to a deal room.
@@ -252,63 +334,682 @@ class DealRoomAI:
             store_name: The full store name.
             file_path: Path to the file to upload.
             display_name: Display name for the file. Defaults to filename.
-            poll_interval: Seconds between status checks. Default: 1.0
+            poll_interval: Initial seconds between status checks. The delay
+                           grows 1.5x per check up to max_poll_interval.
+                           Default: 0.1
+            max_poll_interval: Upper bound on the delay between checks. Default: 2.0
+            timeout: Maximum seconds to wait for processing. None = no limit.
             
         Returns:
             True if successful.
             
         Raises:
+            TimeoutError: If processing does not finish within timeout.
             Exception: If the upload fails.
         """
         if display_name is None:
             display_name = os.path.basename(file_path)
         
-        operation = self.client.file_search_stores.upload_to_file_search_store(
+        return self._upload(
+            store_name, file_path, {"display_name": display_name},
+            poll_interval, max_poll_interval, timeout
+        )
+    
+    async def upload_file_async(
+        self, 
+        store_name: str, 
+        file_path: str, 
+        display_name: Optional[str] = None,
+        poll_interval: float = 0.1,
+        max_poll_interval: float = 2.0,
+        timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Async variant of upload_file(), using the SDK's asyncio client.
+        
+        Takes the same arguments and polls with the same backoff, but awaits
+        between checks instead of blocking a thread, so many uploads can be
+        in flight at once (see upload_many_async()).
+        
+        Returns:
+            True if successful.
+            
+        Raises:
+            TimeoutError: If processing does not finish within timeout.
+            Exception: If the upload fails.
+        """
+        if display_name is None:
+            display_name = os.path.basename(file_path)
+        
+        operation = await self.client.aio.file_search_stores.upload_to_file_search_store(
             file_search_store_name=store_name,
             file=file_path,
             config={"display_name": display_name}
         )
         
-        # Wait for processing to complete
-        while not self.client.operations.get(operation).done:
-            time.sleep(poll_interval)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = poll_interval
+        while not operation.done:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Upload of {display_name} did not finish within {timeout}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, max_poll_interval)
+            operation = await self.client.aio.operations.get(operation)
+        
+        error = _operation_error(operation)
+        if error:
+            raise error
+        self._documents_changed(store_name)
+        return True
+    
+    async def upload_many_async(
+        self,
+        store_name: str,
+        file_paths: list[str],
+        max_concurrency: int = 8,
+        timeout: Optional[float] = None
+    ) -> list:
+        """
+        Upload several documents to a deal room concurrently.
+        
+        Usage:
+            results = asyncio.run(ai.upload_many_async(store.name, ["cim.pdf", "model.xlsx"]))
+            failed = [r for r in results if isinstance(r, Exception)]
+        
+        Args:
+            store_name: The full store name.
+            file_paths: Paths of the files to upload.
+            max_concurrency: Maximum uploads in flight at once. Default: 8
+            timeout: Maximum seconds to wait for each file's processing.
+            
+        Returns:
+            One result per path, in order: True on success, or the exception
+            that upload raised. One failure does not cancel the others.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def upload(file_path: str) -> bool:
+            async with semaphore:
+                return await self.upload_file_async(store_name, file_path, timeout=timeout)
         
+        return await asyncio.gather(*(upload(path) for path in file_paths), return_exceptions=True)
+    
+    def _upload(
+        self,
+        store_name: str,
+        file,
+        config: dict,
+        poll_interval: float = 0.1,
+        max_poll_interval: float = 2.0,
+        timeout: Optional[float] = None
+    ) -> bool:
+        """Submit a path or binary stream to a store and wait until it is indexed."""
+        pending = self._begin_upload(store_name, file, config, poll_interval, max_poll_interval)
+        
+        if not self._poller.result(pending, timeout):
+            raise TimeoutError(f"Upload of {config['display_name']} did not finish within {timeout}s")
+        
+        self._documents_changed(store_name)
         return True
     
+    def _begin_upload(
+        self,
+        store_name: str,
+        file,
+        config: dict,
+        poll_interval: float,
+        max_poll_interval: float
+    ) -> "_PendingOperation":
+        """Submit a path or binary stream to a store and start watching its processing."""
+        operation = self.client.file_search_stores.upload_to_file_search_store(
+            file_search_store_name=store_name,
+            file=file,
+            config=config
+        )
+        # Concurrent uploads share one background poll loop instead of each
+        # sleeping in its own thread
+        return self._poller.watch(operation, poll_interval, max_poll_interval)
+    
+    def upload_many(
+        self,
+        store_name: str,
+        file_paths: list[str],
+        poll_interval: float = 0.1,
+        max_poll_interval: float = 2.0,
+        timeout: Optional[float] = None
+    ) -> list:
+        """
+        Upload several documents to a deal room, processing them in parallel.
+        
+        Every file is submitted before waiting on any of them, so the server
+        indexes them all at once instead of one after another.
+        
+        Usage:
+            results = ai.upload_many(store.name, ["cim.pdf", "model.xlsx"])
+            failed = [r for r in results if isinstance(r, Exception)]
+        
+        Args:
+            store_name: The full store name.
+            file_paths: Paths of the files to upload.
+            poll_interval: Initial seconds between status checks. Default: 0.1
+            max_poll_interval: Upper bound on the delay between checks. Default: 2.0
+            timeout: Maximum seconds, once every file is submitted, to wait
+                     for processing. None = no limit.
+            
+        Returns:
+            One result per path, in order: True on success, or the exception
+            that upload raised. One failure does not stop the others.
+        """
+        return self._await_uploads(store_name, [
+            (file_path, {"display_name": os.path.basename(file_path)})
+            for file_path in file_paths
+        ], poll_interval, max_poll_interval, timeout)
+    
+    def upload_many_bytes(
+        self,
+        store_name: str,
+        files: list[tuple[bytes, str]],
+        poll_interval: float = 0.1,
+        max_poll_interval: float = 2.0,
+        timeout: Optional[float] = None
+    ) -> list:
+        """
+        Upload several documents from bytes, processing them in parallel.
+        
+        Like upload_many(), but for in-memory content (e.g., web uploads).
+        Each file is streamed from memory, and its MIME type is inferred
+        from the filename.
+        
+        Args:
+            store_name: The full store name.
+            files: (file_bytes, filename) pairs.
+            poll_interval: Initial seconds between status checks. Default: 0.1
+            max_poll_interval: Upper bound on the delay between checks. Default: 2.0
+            timeout: Maximum seconds, once every file is submitted, to wait
+                     for processing. None = no limit.
+            
+        Returns:
+            One result per file, in order: True if uploaded, False if
+            identical content was already indexed in this store (or earlier
+            in the batch), or the exception that upload raised (ValueError
+            for a file whose MIME type can't be inferred).
+        """
+        results = [False] * len(files)
+        uploads = []  # (index, sha256, file, config) for files not yet indexed
+        seen = set()
+        synced = False
+        for i, (file_bytes, filename) in enumerate(files):
+            try:
+                mime_type = _guess_mime_type(filename)
+            except ValueError as e:
+                results[i] = e
+                continue
+            sha256 = None
+            if self.upload_registry:
+                sha256 = hashlib.sha256(file_bytes).hexdigest()
+                if sha256 in seen:
+                    continue
+                if self.upload_registry.contains(store_name, sha256):
+                    # Revalidate against the store once per batch
+                    if not synced:
+                        self.sync_upload_registry(store_name)
+                        synced = True
+                    if self.upload_registry.contains(store_name, sha256):
+                        continue
+                seen.add(sha256)
+            uploads.append((i, sha256, io.BytesIO(file_bytes), {"display_name": filename, "mime_type": mime_type}))
+        
+        outcomes = self._await_uploads(
+            store_name, [(file, config) for _, _, file, config in uploads],
+            poll_interval, max_poll_interval, timeout
+        )
+        for (i, sha256, _, config), outcome in zip(uploads, outcomes):
+            results[i] = outcome
+            if outcome is True and sha256:
+                self.upload_registry.add(store_name, sha256, config["display_name"])
+        return results
+    
+    def _await_uploads(
+        self,
+        store_name: str,
+        uploads: list[tuple],
+        poll_interval: float,
+        max_poll_interval: float,
+        timeout: Optional[float]
+    ) -> list:
+        """Submit (file, config) pairs, then wait on all of them; see upload_many()."""
+        handles = []
+        for file, config in uploads:
+            try:
+                handles.append(self._begin_upload(store_name, file, config, poll_interval, max_poll_interval))
+            except Exception as e:
+                handles.append(e)
+        
+        deadline = None if timeout is None else time.monotonic() + timeout
+        results = []
+        for (_, config), handle in zip(uploads, handles):
+            if isinstance(handle, Exception):
+                results.append(handle)
+                continue
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                if not self._poller.result(handle, remaining):
+                    raise TimeoutError(f"Upload of {config['display_name']} did not finish within {timeout}s")
+                results.append(True)
+            except Exception as e:
+                results.append(e)
+        
+        if True in results:
+            self._documents_changed(store_name)
+        return results
+    
+    def _documents_changed(self, store_name: str) -> None:
+        """Drop cached answers for a store whose documents were added or removed."""
+        if self.semantic_cache is not None:
+            self.semantic_cache.invalidate(store_name)
+    
+    def sync_upload_registry(self, store_name: str) -> int:
+        """
+        Drop upload registry records for documents no longer in a deal room.
+        
+        The registry only sees uploads made through this client, so documents
+        deleted elsewhere (e.g., in AI Studio) leave stale records that would
+        make re-uploads of that content be skipped. This lists the store's
+        documents and keeps only records whose file is still active or
+        pending. Upload methods call it automatically before skipping a file.
+        
+        Args:
+            store_name: The full store name.
+            
+        Returns:
+            Number of records dropped (0 if no registry is configured).
+            
+        Raises:
+            Exception: If the API call fails.
+        """
+        if not self.upload_registry:
+            return 0
+        
+        documents = self.client.file_search_stores.documents.list(parent=store_name)
+        live = {
+            doc.display_name for doc in documents
+            if doc.display_name and getattr(doc.state, "name", doc.state) != "STATE_FAILED"
+        }
+        return self.upload_registry.prune(store_name, live)
+    
+    def _already_indexed(self, store_name: str, sha256: str) -> bool:
+        """Return True if the registry (revalidated against the store) holds this content."""
+        if not self.upload_registry.contains(store_name, sha256):
+            return False
+        self.sync_upload_registry(store_name)
+        return self.upload_registry.contains(store_name, sha256)
+    
     def upload_file_bytes(
         self,
         store_name: str,
         file_bytes: bytes,
         filename: str,
-        poll_interval: float = 1.0
+        poll_interval: float = 0.1,
+        max_poll_interval: float = 2.0,
+        timeout: Optional[float] = None
     ) -> bool:
         """
         Upload a document from bytes (e.g., from a web upload).
         
+        The bytes are streamed to the SDK straight from memory (see
+        upload_file_stream()); nothing is written to disk.
+        
         Args:
             store_name: The full store name.
             file_bytes: The file content as bytes.
-            filename: Original filename (used for display and extension).
-            poll_interval: Seconds between status checks.
+            filename: Original filename (used for display and MIME type).
+            poll_interval: Initial seconds between status checks.
+            max_poll_interval: Upper bound on the delay between checks. Default: 2.0
+            timeout: Maximum seconds to wait for processing. None = no limit.
             
         Returns:
-            True if successful.
+            True if the document was uploaded, False if identical content
+            was already indexed in this store.
+            
+        Raises:
+            ValueError: If no MIME type can be inferred from the filename.
+            TimeoutError: If processing does not finish within timeout.
+            Exception: If the upload fails.
+        """
+        return self.upload_file_stream(
+            store_name, io.BytesIO(file_bytes), filename,
+            poll_interval, max_poll_interval, timeout
+        )
+    
+    def upload_fileobj(
+        self,
+        store_name: str,
+        file_obj: BinaryIO,
+        filename: str,
+        poll_interval: float = 0.1,
+        max_poll_interval: float = 2.0,
+        timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Upload a document from a binary file-like object (e.g., a web upload).
+        
+        The content is copied to a temp file in 1 MiB chunks, so peak memory
+        stays bounded regardless of file size and the object need not be
+        seekable. If an upload registry is configured, the content is SHA-256
+        hashed during the copy and files already indexed in this store are
+        skipped.
+        
+        Args:
+            store_name: The full store name.
+            file_obj: Readable binary file-like object, read from its current position.
+            filename: Original filename (used for display and MIME type).
+            poll_interval: Initial seconds between status checks.
+            max_poll_interval: Upper bound on the delay between checks. Default: 2.0
+            timeout: Maximum seconds to wait for processing. None = no limit.
+            
+        Returns:
+            True if the document was uploaded, False if identical content
+            was already indexed in this store.
             
         Raises:
+            ValueError: If no MIME type can be inferred from the filename.
+            TimeoutError: If processing does not finish within timeout.
             Exception: If the upload fails.
         """
-        # Save to temp file with safe name
-        file_ext = os.path.splitext(filename)[1] if '.' in filename else ''
-        temp_path = f"/tmp/{uuid.uuid4().hex}{file_ext}"
+        # Reject unsupported types before copying anything
+        mime_type = _guess_mime_type(filename)
+        temp_file = tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1], delete=False)
+        digest = hashlib.sha256()
         
         try:
-            with open(temp_path, "wb") as f:
-                f.write(file_bytes)
+            with temp_file:
+                while chunk := file_obj.read(UPLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            
+            sha256 = digest.hexdigest()
+            if self.upload_registry and self._already_indexed(store_name, sha256):
+                return False
             
-            return self.upload_file(store_name, temp_path, filename, poll_interval)
+            self._upload(
+                store_name, temp_file.name,
+                {"display_name": filename, "mime_type": mime_type},
+                poll_interval, max_poll_interval, timeout
+            )
+            if self.upload_registry:
+                self.upload_registry.add(store_name, sha256, filename)
+            return True
         finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            # A vanished temp file must not mask the original error
+            try:
+                os.unlink(temp_file.name)
+            except FileNotFoundError:
+                pass
+    
+    def upload_file_stream(
+        self,
+        store_name: str,
+        file_obj: BinaryIO,
+        filename: str,
+        poll_interval: float = 0.1,
+        max_poll_interval: float = 2.0,
+        timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Upload a document by streaming a seekable binary file-like object.
+        
+        The SDK reads the object in chunks as it sends it, so nothing is
+        copied to memory or disk.
+        
+        Args:
+            store_name: The full store name.
+            file_obj: Seekable binary file-like object, read from its current position.
+            filename: Original filename (used for display and MIME type).
+            poll_interval: Initial seconds between status checks.
+            max_poll_interval: Upper bound on the delay between checks. Default: 2.0
+            timeout: Maximum seconds to wait for processing. None = no limit.
+            
+        Returns:
+            True if the document was uploaded, False if identical content
+            was already indexed in this store.
+            
+        Raises:
+            ValueError: If no MIME type can be inferred from the filename.
+            TimeoutError: If processing does not finish within timeout.
+            Exception: If the upload fails.
+        """
+        mime_type = _guess_mime_type(filename)
+        
+        if self.upload_registry:
+            # Hash in a separate pass, then rewind for the SDK
+            start = file_obj.tell()
+            digest = hashlib.sha256()
+            while chunk := file_obj.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+            file_obj.seek(start)
+            sha256 = digest.hexdigest()
+            if self._already_indexed(store_name, sha256):
+                return False
+        
+        self._upload(
+            store_name, file_obj,
+            {"display_name": filename, "mime_type": mime_type},
+            poll_interval, max_poll_interval, timeout
+        )
+        if self.upload_registry:
+            self.upload_registry.add(store_name, sha256, filename)
+        return True
+    
+    def _embed(self, text: str) -> array:
+        """Embed a question for semantic cache lookups."""
+        from google.genai import types
+        
+        cached = self._cached_embedding(text)
+        if cached is not None:
+            return cached
+        
+        result = self.client.models.embed_content(
+            model=self.embedding_model,
+            contents=text,
+            config=types.EmbedContentConfig(
+                task_type="SEMANTIC_SIMILARITY",
+                output_dimensionality=768
+            )
+        )
+        return self._remember_embedding(text, result.embeddings[0].values)
+    
+    async def _aembed(self, text: str) -> array:
+        """Async variant of _embed()."""
+        from google.genai import types
+        
+        cached = self._cached_embedding(text)
+        if cached is not None:
+            return cached
+        
+        result = await self.client.aio.models.embed_content(
+            model=self.embedding_model,
+            contents=text,
+            config=types.EmbedContentConfig(
+                task_type="SEMANTIC_SIMILARITY",
+                output_dimensionality=768
+            )
+        )
+        return self._remember_embedding(text, result.embeddings[0].values)
+    
+    def _cached_embedding(self, text: str) -> Optional[array]:
+        """Return a previously computed embedding for text, if still cached."""
+        with self._embeddings_lock:
+            embedding = self._embeddings.get(text)
+            if embedding is not None:
+                self._embeddings.move_to_end(text)
+            return embedding
+    
+    def _remember_embedding(self, text: str, values: list[float]) -> array:
+        """Cache an embedding for text, evicting the least recently used."""
+        embedding = array("f", values)
+        with self._embeddings_lock:
+            self._embeddings[text] = embedding
+            if len(self._embeddings) > EMBEDDING_CACHE_SIZE:
+                self._embeddings.popitem(last=False)
+        return embedding
+    
+    def _cache_lookup(
+        self,
+        store_name: str,
+        message: str,
+        history: Optional[list[dict]],
+        system_prompt: str,
+        thinking_budget: int
+    ) -> tuple[Optional[ChatResponse], Optional[array]]:
+        """
+        Look a question up in the semantic cache.
+        
+        The cache is an optimization, so any failure (e.g. the embedding call
+        hitting a quota) is logged and treated as a miss.
+        
+        Returns:
+            Tuple of (cached ChatResponse or None, query embedding for
+            _cache_add(), or None if it couldn't be computed).
+        """
+        try:
+            cached = self.semantic_cache.get(store_name, message, history, system_prompt, thinking_budget)
+            if cached:
+                return cached, None
+            query_embedding = self._embed(message)
+            cached = self.semantic_cache.lookup(store_name, query_embedding, history, system_prompt, thinking_budget)
+            return cached, query_embedding
+        except Exception:
+            logger.warning("Semantic cache lookup failed; answering without it", exc_info=True)
+            return None, None
+    
+    async def _acache_lookup(
+        self,
+        store_name: str,
+        message: str,
+        history: Optional[list[dict]],
+        system_prompt: str,
+        thinking_budget: int
+    ) -> tuple[Optional[ChatResponse], Optional[array]]:
+        """Async variant of _cache_lookup()."""
+        try:
+            cached = self.semantic_cache.get(store_name, message, history, system_prompt, thinking_budget)
+            if cached:
+                return cached, None
+            query_embedding = await self._aembed(message)
+            cached = self.semantic_cache.lookup(store_name, query_embedding, history, system_prompt, thinking_budget)
+            return cached, query_embedding
+        except Exception:
+            logger.warning("Semantic cache lookup failed; answering without it", exc_info=True)
+            return None, None
+    
+    def _cache_add(
+        self,
+        store_name: str,
+        query_embedding: Optional[array],
+        response: ChatResponse,
+        message: str,
+        history: Optional[list[dict]],
+        system_prompt: str,
+        thinking_budget: int
+    ) -> None:
+        """Cache an answer; skipped without an embedding, and failures are only logged."""
+        if query_embedding is None:
+            return
+        try:
+            self.semantic_cache.add(
+                store_name, query_embedding, response, message, history, system_prompt, thinking_budget
+            )
+        except Exception:
+            logger.warning("Could not cache answer", exc_info=True)
+    
+    def _resolve_thinking_budget(
+        self,
+        thinking_budget: Optional[int],
+        budget_profile: Optional[BudgetProfile]
+    ) -> int:
+        """Return the effective thinking budget: explicit, else profile, else the default."""
+        if thinking_budget is not None:
+            return thinking_budget
+        if budget_profile is None:
+            return self.thinking_budget
+        try:
+            return THINKING_BUDGET_PROFILES[budget_profile]
+        except KeyError:
+            raise ValueError(
+                f"Unknown budget_profile {budget_profile!r}; "
+                f"expected one of {', '.join(THINKING_BUDGET_PROFILES)}"
+            ) from None
+    
+    def _build_request(
+        self,
+        store_name: str,
+        message: str,
+        history: Optional[list[dict]],
+        system_prompt: Optional[str],
+        thinking_budget: Optional[int]
+    ) -> tuple[list, "types.GenerateContentConfig"]:
+        """Build the contents and config shared by chat() and chat_stream()."""
+        effective_system_prompt = system_prompt or self.system_prompt
+        effective_thinking_budget = thinking_budget if thinking_budget is not None else self.thinking_budget
+        config = self._request_config(store_name, effective_system_prompt, effective_thinking_budget)
+        return self._build_contents(message, history), config
+    
+    def _build_contents(self, message: str, history: Optional[list[dict]]) -> list:
+        """Build the conversation contents: the recent history, then the question."""
+        from google.genai import types
+        
+        # Only user/model turns are sent; UI-side markers (e.g. truncation
+        # notices) are dropped
+        history = [m for m in history or [] if m["role"] in ("user", "model")]
+        # Keep only the most recent exchanges to bound prompt size
+        if self.max_history_turns is not None:
+            history = history[-2 * self.max_history_turns:] if self.max_history_turns > 0 else []
+        
+        # Build conversation contents. Earlier turns are resent every time,
+        # so their Content objects are memoized rather than rebuilt.
+        contents = [_to_content(msg["role"], msg["content"]) for msg in history]
+        contents.append(types.Content(
+            role="user",
+            parts=[types.Part(text=message)]
+        ))
+        return contents
+    
+    def _request_config(
+        self,
+        store_name: str,
+        system_prompt: str,
+        thinking_budget: int
+    ) -> "types.GenerateContentConfig":
+        """Return the (shared, treat as read-only) config for a store, prompt, and budget."""
+        key = (store_name, system_prompt, thinking_budget)
+        with self._configs_lock:
+            config = self._configs.get(key)
+            if config is not None:
+                self._configs.move_to_end(key)
+                return config
+        
+        from google.genai import types
+        
+        # Build config with system prompt, thinking, and file search. The
+        # prompt is passed as a ready-made Content (what the SDK would wrap a
+        # str in) so it isn't re-wrapped on every request.
+        config = types.GenerateContentConfig(
+            system_instruction=_to_content("user", system_prompt),
+            tools=[types.Tool(
+                file_search=types.FileSearch(
+                    file_search_store_names=[store_name]
+                )
+            )],
+            thinking_config=types.ThinkingConfig(
+                thinking_budget=thinking_budget,
+                include_thoughts=True
+            )
+        )
+        with self._configs_lock:
+            self._configs[key] = config
+            if len(self._configs) > CONFIG_CACHE_SIZE:
+                self._configs.popitem(last=False)
+        return config
     
     def chat(
         self, 
@@ -316,7 +1017,8 @@ class DealRoomAI:
         message: str, 
         history: Optional[list[dict]] = None,
         system_prompt: Optional[str] = None,
-        thinking_budget: Optional[int] = None
+        thinking_budget: Optional[int] = None,
+        budget_profile: Optional[BudgetProfile] = None
     ) -> ChatResponse:
         """
         Query documents in a deal room with RAG.
@@ -326,8 +1028,12 @@ class DealRoomAI:
             message: The user's question.
             history: Optional conversation history. Each item should have
                      'role' ('user' or 'model') and 'content' (str) keys.
+                     Items with any other role are ignored.
             system_prompt: Override the default system prompt for this query.
             thinking_budget: Override the default thinking budget for this query.
+            budget_profile: Pick the thinking budget by query type instead:
+                     "fast" (0, short lookups), "balanced" (2048), or "deep"
+                     (-1, dynamic). Ignored if thinking_budget is given.
                      
         Returns:
             ChatResponse with text, citations, grounding details, and thinking.
@@ -335,34 +1041,19 @@ class DealRoomAI:
         Raises:
             Exception: If the API call fails.
         """
-        history = history or []
-        effective_system_prompt = system_prompt or self.system_prompt
-        effective_thinking_budget = thinking_budget if thinking_budget is not None else self.thinking_budget
-        
-        # Build conversation contents
-        contents = []
-        for msg in history:
-            contents.append(types.Content(
-                role=msg["role"],
-                parts=[types.Part(text=msg["content"])]
-            ))
-        contents.append(types.Content(
-            role="user",
-            parts=[types.Part(text=message)]
-        ))
+        thinking_budget = self._resolve_thinking_budget(thinking_budget, budget_profile)
+        # Serve repeated and near-duplicate questions from the semantic cache.
+        # Answers are keyed on the effective system prompt and thinking
+        # budget, so overrides and budget profiles get their own entries.
+        use_cache = self.semantic_cache is not None
+        prompt = system_prompt or self.system_prompt
+        if use_cache:
+            cached, query_embedding = self._cache_lookup(store_name, message, history, prompt, thinking_budget)
+            if cached:
+                return cached
         
-        # Build config with system prompt, thinking, and file search
-        config = types.GenerateContentConfig(
-            system_instruction=effective_system_prompt,
-            tools=[types.Tool(
-                file_search=types.FileSearch(
-                    file_search_store_names=[store_name]
-                )
-            )],
-            thinking_config=types.ThinkingConfig(
-                thinking_budget=effective_thinking_budget,
-                include_thoughts=True
-            )
+        contents, config = self._build_request(
+            store_name, message, history, system_prompt, thinking_budget
         )
         
         # Make the API call
@@ -372,70 +1063,564 @@ class DealRoomAI:
             config=config
         )
         
-        # Extract thinking content if available
-        thinking_text = None
-        response_text = response.text
+        chat_response = _to_chat_response(response)
+        if use_cache:
+            self._cache_add(store_name, query_embedding, chat_response, message, history, prompt, thinking_budget)
+        return chat_response
+    
+    async def achat(
+        self, 
+        store_name: str, 
+        message: str, 
+        history: Optional[list[dict]] = None,
+        system_prompt: Optional[str] = None,
+        thinking_budget: Optional[int] = None,
+        budget_profile: Optional[BudgetProfile] = None
+    ) -> ChatResponse:
+        """
+        Async variant of chat(), using the SDK's asyncio client.
         
-        # Check for thinking parts in the response
-        if response.candidates and response.candidates[0].content:
-            parts = response.candidates[0].content.parts
-            thinking_parts = []
-            text_parts = []
-            with open("parts.txt", "w") as f:
-                for part in parts:
-                    f.write(str(part) + "\n")
-                    f.write("--------------------------------\n")
-                    f.write("--------------------------------\n")
-            for part in parts:
-                if hasattr(part, 'thought') and part.thought:
-                    print("Thought: ", part.text)
-                    thinking_parts.append(part.text)
-                elif hasattr(part, 'text') and part.text:
-                    text_parts.append(part.text)
+        Takes the same arguments and returns the same ChatResponse. The event
+        loop stays free while the request is in flight, so callers can run
+        several queries concurrently (e.g. with asyncio.gather).
+        
+        Usage:
+            response = asyncio.run(ai.achat(store.name, "What are the key risks?"))
             
-            if thinking_parts:
-                thinking_text = "\n".join(thinking_parts)
-            if text_parts:
-                response_text = "\n".join(text_parts)
-        
-        # Extract citations and grounding
-        citations = []
-        grounding_details = {"chunks": [], "supports": []}
-        
-        if response.candidates and response.candidates[0].grounding_metadata:
-            grounding = response.candidates[0].grounding_metadata
-            
-            # Extract chunks (retrieved passages)
-            if grounding.grounding_chunks:
-                for i, chunk in enumerate(grounding.grounding_chunks):
-                    if chunk.retrieved_context:
-                        ctx = chunk.retrieved_context
-                        detail = {
-                            "index": i,
-                            "title": ctx.title if ctx.title else "Unknown",
-                            "text": ctx.text[:500] + "..." if ctx.text and len(ctx.text) > 500 else ctx.text,
-                        }
-                        grounding_details["chunks"].append(detail)
-                        if ctx.title:
-                            citations.append(ctx.title)
-                
-                citations = list(dict.fromkeys(citations))  # Dedupe preserving order
+        Raises:
+            Exception: If the API call fails.
+        """
+        thinking_budget = self._resolve_thinking_budget(thinking_budget, budget_profile)
+        use_cache = self.semantic_cache is not None
+        prompt = system_prompt or self.system_prompt
+        if use_cache:
+            cached, query_embedding = await self._acache_lookup(store_name, message, history, prompt, thinking_budget)
+            if cached:
+                return cached
+        
+        contents, config = self._build_request(
+            store_name, message, history, system_prompt, thinking_budget
+        )
+        
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=contents,
+            config=config
+        )
+        
+        chat_response = _to_chat_response(response)
+        if use_cache:
+            self._cache_add(store_name, query_embedding, chat_response, message, history, prompt, thinking_budget)
+        return chat_response
+    
+    def chat_stream(
+        self, 
+        store_name: str, 
+        message: str, 
+        history: Optional[list[dict]] = None,
+        system_prompt: Optional[str] = None,
+        thinking_budget: Optional[int] = None,
+        budget_profile: Optional[BudgetProfile] = None
+    ) -> "ChatStream":
+        """
+        Query documents in a deal room, streaming the answer as it is generated.
+        
+        Takes the same arguments as chat(). Iterate the returned ChatStream to
+        receive text deltas; once exhausted, its `response` attribute holds the
+        full ChatResponse with citations, grounding details, and thinking.
+        
+        Usage:
+            stream = ai.chat_stream(store.name, "What are the key risks?")
+            for delta in stream:
+                print(delta, end="")
+            print(stream.response.citations)
+            
+        Returns:
+            ChatStream over the answer text.
             
-            # Extract supports (which chunks support which parts of the answer)
-            if hasattr(grounding, 'grounding_supports') and grounding.grounding_supports:
-                for support in grounding.grounding_supports:
-                    if support.segment and support.segment.text:
-                        grounding_details["supports"].append({
-                            "text": support.segment.text,
-                            "chunk_indices": list(support.grounding_chunk_indices) if support.grounding_chunk_indices else []
-                        })
+        Raises:
+            Exception: If the API call fails (raised while iterating).
+        """
+        thinking_budget = self._resolve_thinking_budget(thinking_budget, budget_profile)
+        on_complete = None
+        if self.semantic_cache is not None:
+            prompt = system_prompt or self.system_prompt
+            cached, query_embedding = self._cache_lookup(store_name, message, history, prompt, thinking_budget)
+            if cached:
+                return ChatStream.from_response(cached)
+            
+            def on_complete(response: ChatResponse) -> None:
+                self._cache_add(store_name, query_embedding, response, message, history, prompt, thinking_budget)
+        
+        contents, config = self._build_request(
+            store_name, message, history, system_prompt, thinking_budget
+        )
+        
+        chunks = self.client.models.generate_content_stream(
+            model=self.model,
+            contents=contents,
+            config=config
+        )
+        return ChatStream(chunks, on_complete)
+    
+    async def chat_decomposed(
+        self, 
+        store_name: str, 
+        message: str, 
+        history: Optional[list[dict]] = None,
+        k: int = 4,
+        system_prompt: Optional[str] = None,
+        thinking_budget: Optional[int] = None,
+        budget_profile: Optional[BudgetProfile] = None
+    ) -> ChatResponse:
+        """
+        Answer a multi-angle question by splitting it into parallel sub-queries.
+        
+        A cheap model breaks the question into up to k sub-questions, each is
+        answered against the deal room concurrently with achat(), and a final
+        call synthesizes the findings into one answer. Wall-clock time is
+        roughly one decomposition, the slowest sub-query, and one synthesis.
         
+        Usage:
+            response = asyncio.run(ai.chat_decomposed(store.name, "Assess the deal"))
+        
+        Args:
+            store_name: The full store name to search.
+            message: The user's question.
+            history: Optional conversation history, as for chat(). Only the
+                     synthesis call sees it; sub-questions are self-contained.
+            k: Maximum number of sub-questions. Default: 4
+            system_prompt: Override the default system prompt for this query.
+            thinking_budget: Override the default thinking budget for this query.
+            budget_profile: Pick the thinking budget by query type instead:
+                     "fast" (0, short lookups), "balanced" (2048), or "deep"
+                     (-1, dynamic). Ignored if thinking_budget is given.
+            
+        Returns:
+            ChatResponse with the synthesized text, the sub-answers' merged
+            citations and grounding details, and the synthesis thinking.
+            
+        Raises:
+            Exception: If an API call fails.
+        """
+        thinking_budget = self._resolve_thinking_budget(thinking_budget, budget_profile)
+        sub_queries = await self._decompose_query(message, k)
+        if len(sub_queries) < 2:
+            return await self.achat(store_name, message, history, system_prompt, thinking_budget)
+        
+        sub_responses = await asyncio.gather(*[
+            self.achat(store_name, sub_query, None, system_prompt, thinking_budget)
+            for sub_query in sub_queries
+        ])
+        
+        from google.genai import types
+        
+        findings = "\n\n".join(
+            f"### Sub-question {i}: {sub_query}\n{response.text}"
+            for i, (sub_query, response) in enumerate(zip(sub_queries, sub_responses), 1)
+        )
+        contents = self._build_contents(SYNTHESIS_PROMPT.format(question=message, findings=findings), history)
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=contents,
+            config=types.GenerateContentConfig(
+                system_instruction=_to_content("user", system_prompt or self.system_prompt),
+                thinking_config=types.ThinkingConfig(
+                    thinking_budget=thinking_budget,
+                    include_thoughts=True
+                )
+            )
+        )
+        
+        synthesis = _to_chat_response(response)
+        citations, grounding = _merge_grounding(sub_responses)
         return ChatResponse(
-            text=response_text,
+            text=synthesis.text,
+            citations=citations,
+            grounding=grounding,
+            thinking=synthesis.thinking
+        )
+    
+    async def _decompose_query(self, message: str, k: int) -> list[str]:
+        """Split a question into at most k sub-questions; [message] if it can't be split."""
+        from google.genai import types
+        
+        response = await self.client.aio.models.generate_content(
+            model=DECOMPOSITION_MODEL,
+            contents=DECOMPOSITION_PROMPT.format(k=k, question=message),
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                thinking_config=types.ThinkingConfig(thinking_budget=0)
+            )
+        )
+        try:
+            sub_queries = json.loads(response.text or "")
+        except ValueError:
+            return [message]
+        if not isinstance(sub_queries, list):
+            return [message]
+        sub_queries = [q.strip() for q in sub_queries if isinstance(q, str) and q.strip()]
+        return sub_queries[:k] or [message]
+
+
+class ChatStream:
+    """
+    Streamed response from a chat query.
+    
+    Yields answer text deltas as they arrive. Thinking parts are collected
+    rather than yielded, and grounding metadata (which Gemini attaches to the
+    final chunks) is extracted once the stream ends.
+    """
+    
+    def __init__(
+        self,
+        chunks: Iterator,
+        on_complete: Optional[Callable[[ChatResponse], None]] = None
+    ):
+        """
+        Args:
+            chunks: Iterator of GenerateContentResponse chunks.
+            on_complete: Called with the assembled ChatResponse once the
+                         stream finishes without error.
+        """
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self.response: Optional[ChatResponse] = None
+    
+    @classmethod
+    def from_response(cls, response: ChatResponse) -> "ChatStream":
+        """Wrap an already complete response (e.g. a cache hit) as a stream."""
+        stream = cls(iter(()))
+        stream.response = response
+        return stream
+    
+    def __iter__(self) -> Iterator[str]:
+        if self.response is not None:
+            yield self.response.text
+            return
+        
+        text_parts = []
+        thinking_parts = []
+        grounding = None
+        
+        for chunk in self._chunks:
+            if not chunk.candidates:
+                continue
+            candidate = chunk.candidates[0]
+            if candidate.grounding_metadata:
+                grounding = candidate.grounding_metadata
+            if not (candidate.content and candidate.content.parts):
+                continue
+            for part in candidate.content.parts:
+                if not part.text:
+                    continue
+                if part.thought:
+                    thinking_parts.append(part.text)
+                else:
+                    text_parts.append(part.text)
+                    yield part.text
+        
+        citations, grounding_details = _extract_grounding(grounding)
+        self.response = ChatResponse(
+            text="".join(text_parts),
             citations=citations,
             grounding=grounding_details,
-            thinking=thinking_text
+            thinking="".join(thinking_parts) or None
+        )
+        if self._on_complete:
+            self._on_complete(self.response)
+
+
+@dataclass
+class _PendingOperation:
+    """A long-running operation being watched by _OperationPoller."""
+    operation: object
+    delay: float
+    max_delay: float
+    next_check: float
+    done: threading.Event = field(default_factory=threading.Event)
+    error: Optional[Exception] = None
+
+
+class _OperationPoller:
+    """
+    Polls every in-flight operation from a single background thread.
+    
+    Each operation keeps its own exponential backoff schedule, and the thread
+    sleeps until the earliest check is due. Checks that fall due together run
+    concurrently on a small pool. The thread starts on demand and exits once
+    nothing is pending.
+    """
+    
+    def __init__(self, client):
+        self._client = client
+        self._pending: list[_PendingOperation] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+    
+    def watch(self, operation, poll_interval: float, max_poll_interval: float) -> _PendingOperation:
+        """Start polling an operation without blocking; pass the handle to result()."""
+        pending = _PendingOperation(
+            operation=operation,
+            delay=poll_interval,
+            max_delay=max_poll_interval,
+            next_check=time.monotonic(),
         )
+        with self._cond:
+            self._pending.append(pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="operation-poller", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return pending
+    
+    def result(self, pending: _PendingOperation, timeout: Optional[float]) -> bool:
+        """
+        Block until a watched operation is done.
+        
+        Returns:
+            True if the operation finished, False if timeout elapsed first.
+            
+        Raises:
+            Exception: If polling the operation fails.
+        """
+        if not pending.done.wait(timeout):
+            with self._cond:
+                if pending in self._pending:
+                    self._pending.remove(pending)
+            return pending.done.is_set()
+        if pending.error:
+            raise pending.error
+        return True
+    
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._thread = None
+                    return
+                now = time.monotonic()
+                due = [p for p in self._pending if p.next_check <= now]
+                if not due:
+                    self._cond.wait(min(p.next_check for p in self._pending) - now)
+                    continue
+            
+            # Poll outside the lock so new operations can register meanwhile.
+            # The SDK has no batch status call, so when several checks are due
+            # they run concurrently and a round costs one round trip, not N.
+            if len(due) > 1:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(POLL_CONCURRENCY, thread_name_prefix="operation-poll")
+                results = list(self._executor.map(self._check, due))
+            else:
+                results = [self._check(due[0])]
+            finished = [pending for pending, done in zip(due, results) if done]
+            
+            with self._cond:
+                for pending in finished:
+                    if pending in self._pending:
+                        self._pending.remove(pending)
+                    pending.done.set()
+    
+    def _check(self, pending: _PendingOperation) -> bool:
+        """Refresh one operation; return True once it is done, failed, or polling failed."""
+        try:
+            pending.operation = self._client.operations.get(pending.operation)
+        except Exception as e:
+            pending.error = e
+            return True
+        if pending.operation.done:
+            pending.error = _operation_error(pending.operation)
+            return True
+        pending.delay = min(pending.delay * 1.5, pending.max_delay)
+        pending.next_check = time.monotonic() + pending.delay
+        return False
+
+
+@lru_cache(maxsize=256)
+def _to_content(role: str, text: str) -> "types.Content":
+    """Build a single-part Content for a history turn or system prompt (shared, treat as read-only)."""
+    from google.genai import types
+    
+    return types.Content(role=role, parts=[types.Part(text=text)])
+
+
+def _to_store_info(store) -> StoreInfo:
+    """Convert a FileSearchStore into a StoreInfo."""
+    return StoreInfo(
+        name=store.name,
+        display_name=store.display_name,
+        active_documents_count=int(store.active_documents_count or 0),
+        pending_documents_count=int(store.pending_documents_count or 0),
+        failed_documents_count=int(store.failed_documents_count or 0),
+    )
+
+
+def _guess_mime_type(filename: str) -> str:
+    """Infer a file's MIME type from its name; raise ValueError if it can't be."""
+    mime_type, _ = mimetypes.guess_type(filename)
+    if mime_type is None:
+        raise ValueError(f"Unsupported file type for {filename}: no MIME type for its extension")
+    return mime_type
+
+
+def _operation_error(operation) -> Optional[RuntimeError]:
+    """Return the error of a finished operation that failed, or None if it succeeded."""
+    error = getattr(operation, "error", None)
+    if not error:
+        return None
+    message = error.get("message") if isinstance(error, dict) else error
+    return RuntimeError(f"Operation {getattr(operation, 'name', '')} failed: {message}")
+
+
+def _shared_client(api_key: Optional[str]):
+    """
+    Return the process-wide genai.Client for an API key, creating it once.
+    
+    Sharing the client keeps its HTTP connection pool (and warm TLS
+    sessions) alive across DealRoomAI instances; `client.aio` shares it too.
+    
+    Args:
+        api_key: Google AI API key, or None to use the GEMINI_API_KEY env var.
+        
+    Returns:
+        A genai.Client.
+    """
+    key = api_key or ""
+    client = _CLIENT_CACHE.get(key)
+    if client is None:
+        with _CLIENT_CACHE_LOCK:
+            client = _CLIENT_CACHE.get(key)
+            if client is None:
+                from google import genai
+                
+                client = genai.Client(api_key=api_key) if api_key else genai.Client()
+                _CLIENT_CACHE[key] = client
+    return client
+
+
+def _to_chat_response(response) -> ChatResponse:
+    """Convert a complete GenerateContentResponse into a ChatResponse."""
+    # Split thinking parts from answer parts in a single pass
+    thinking_text = None
+    response_text = None
+    
+    if response.candidates and response.candidates[0].content:
+        thinking_parts = []
+        text_parts = []
+        for part in response.candidates[0].content.parts or ():
+            text = getattr(part, 'text', None)
+            if not text:
+                continue
+            if getattr(part, 'thought', False):
+                thinking_parts.append(text)
+            else:
+                text_parts.append(text)
+    
+        if thinking_parts:
+            thinking_text = "\n".join(thinking_parts)
+        if text_parts:
+            response_text = "\n".join(text_parts)
+    
+    if response_text is None:
+        response_text = response.text
+    
+    grounding = response.candidates[0].grounding_metadata if response.candidates else None
+    citations, grounding_details = _extract_grounding(grounding)
+    
+    return ChatResponse(
+        text=response_text,
+        citations=citations,
+        grounding=grounding_details,
+        thinking=thinking_text
+    )
+
+
+def _extract_grounding(grounding) -> tuple[list[str], dict]:
+    """
+    Extract citations and grounding details from grounding metadata.
+    
+    Args:
+        grounding: A candidate's grounding_metadata, or None.
+        
+    Returns:
+        Tuple of (deduplicated citation titles, grounding details dict with
+        'chunks' and 'supports' lists).
+    """
+    citations = []
+    grounding_details = {"chunks": [], "supports": []}
+    
+    if not grounding:
+        return citations, grounding_details
+    
+    # Extract chunks (retrieved passages), deduping citations in the same
+    # pass while preserving order
+    if grounding.grounding_chunks:
+        seen = set()
+        for i, chunk in enumerate(grounding.grounding_chunks):
+            ctx = chunk.retrieved_context
+            if not ctx:
+                continue
+            title = ctx.title
+            text = ctx.text
+            grounding_details["chunks"].append({
+                "index": i,
+                "title": title if title else "Unknown",
+                "text": text[:500] + "..." if text and len(text) > 500 else text,
+            })
+            if title and title not in seen:
+                seen.add(title)
+                citations.append(title)
+    
+    # Extract supports (which chunks support which parts of the answer)
+    if hasattr(grounding, 'grounding_supports') and grounding.grounding_supports:
+        for support in grounding.grounding_supports:
+            if support.segment and support.segment.text:
+                grounding_details["supports"].append({
+                    "text": support.segment.text,
+                    "chunk_indices": list(support.grounding_chunk_indices) if support.grounding_chunk_indices else []
+                })
+    
+    return citations, grounding_details
+
+
+def _merge_grounding(responses: list[ChatResponse]) -> tuple[list[str], dict]:
+    """
+    Merge citations and grounding details from several responses.
+    
+    Citations are deduplicated in order; chunk indices are offset so each
+    support still points at its own response's chunks.
+    
+    Args:
+        responses: ChatResponses whose grounding details should be combined.
+        
+    Returns:
+        Tuple of (deduplicated citation titles, grounding details dict with
+        'chunks' and 'supports' lists).
+    """
+    citations = list(dict.fromkeys(c for r in responses for c in r.citations))
+    grounding_details = {"chunks": [], "supports": []}
+    offset = 0
+    
+    for response in responses:
+        chunks = response.grounding.get("chunks", [])
+        supports = response.grounding.get("supports", [])
+        for chunk in chunks:
+            grounding_details["chunks"].append({**chunk, "index": chunk["index"] + offset})
+        for support in supports:
+            grounding_details["supports"].append({
+                "text": support["text"],
+                "chunk_indices": [i + offset for i in support["chunk_indices"]]
+            })
+        # Indices follow the original grounding chunks, some of which may
+        # have been skipped, so advance past the highest one referenced
+        offset += 1 + max(
+            [c["index"] for c in chunks] + [i for s in supports for i in s["chunk_indices"]],
+            default=-1
+        )
+    
+    return citations, grounding_details
 
 
 # Convenience function for quick usage
@@ -465,29 +1650,11 @@ def create_client(
     )
 
 
-# --- Future: Query Decomposition (Level 2) ---
+# --- Future: Iterative Retrieval (Level 2) ---
 # 
-# For complex queries that require multi-angle analysis, consider implementing:
-#
-# 1. Query Decomposition:
-#    - Use an LLM to break complex query into sub-questions
-#    - Run file search for each sub-question in parallel
-#    - Aggregate results and synthesize final answer
+# Query decomposition is implemented by chat_decomposed(). A natural next step:
 #
-# 2. Iterative Retrieval:
+# Iterative Retrieval:
 #    - After initial retrieval, analyze if information gaps exist
 #    - Generate follow-up queries to fill gaps
 #    - Continue until sufficient coverage
-#
-# Example structure:
-#
-# def chat_advanced(self, store_name: str, message: str, ...) -> ChatResponse:
-#     # Step 1: Decompose query
-#     sub_queries = self._decompose_query(message)
-#     
-#     # Step 2: Run parallel searches
-#     results = [self._search(store_name, q) for q in sub_queries]
-#     
-#     # Step 3: Synthesize final answer
-#     return self._synthesize(message, results)
-
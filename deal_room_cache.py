@@ -0,0 +1,525 @@
+"""
+Deal Room Cache - Local caching for deal room queries
+
+This module holds caches that sit in front of the Gemini API. It has no
+dependency on the GenAI SDK, so it can be reused by any front end.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+from deal_room_ai import ChatResponse
+
+
+@dataclass
+class _CacheEntry:
+    """A cached response, the normalized embedding of its query, and its keys."""
+    vector: np.ndarray
+    response: ChatResponse
+    created: float
+    last_used: float
+    key: str = ""
+    context: str = ""
+
+
+class SemanticCache:
+    """
+    Per-store cache of chat responses keyed by query embedding.
+
+    A lookup returns a cached response when a previous query in the same
+    deal room has cosine similarity >= threshold with the new one, so
+    repeated or paraphrased questions skip the LLM round-trip entirely.
+    Exact repeats (after case and whitespace normalization) are found by
+    get() without embedding the query at all.
+
+    Matches are scoped to the conversation context: the system prompt and
+    the last user/model exchange of the history. A follow-up like
+    "summarize that again" only reuses an answer given after the same
+    preceding exchange, under the same instructions.
+
+    Each store keeps at most max_entries responses (least recently used are
+    evicted first), and entries older than ttl seconds are discarded. The
+    cache is safe to share between threads.
+
+    When a database path is given, entries are also written to SQLite so they
+    survive restarts and are shared by every session using the same file.
+    A store's rows are loaded into memory the first time it is queried.
+    Rows record the embedding model and dimension they were computed with,
+    so switching models never compares vectors from different spaces.
+
+    Usage:
+        cache = SemanticCache(path="cache.db")
+        ai = DealRoomAI(api_key="your-key", semantic_cache=cache)
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        max_entries: int = 128,
+        ttl: float = 900.0,
+        path: Optional[str] = None,
+        embedding_model: str = "gemini-embedding-001"
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            threshold: Minimum cosine similarity for a hit. Default: 0.92
+            max_entries: Maximum cached responses per store. Default: 128
+            ttl: Seconds before an entry goes stale. Default: 900 (15 minutes)
+            path: SQLite database file for persistence. If None, the cache
+                  is in-memory only.
+            embedding_model: Model the query embeddings come from; must match
+                             DealRoomAI's. Persisted rows from other models
+                             are ignored.
+        """
+        self.threshold = threshold
+        self.embedding_model = embedding_model
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: dict[str, list[_CacheEntry]] = {}
+        self._matrices: dict[str, np.ndarray] = {}
+        self._exact: dict[str, dict[str, _CacheEntry]] = {}
+        self._loaded: set[str] = set()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            # Access is serialized by self._lock, so one connection is shared
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS qa_cache ("
+                "store TEXT, emb BLOB, resp TEXT, citations TEXT, "
+                "grounding TEXT, thinking TEXT, ts REAL, model TEXT, dim INTEGER, "
+                "key TEXT, context TEXT)"
+            )
+            # Databases written before exact-match keys lack the last two columns
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(qa_cache)")}
+            for column in ("key", "context"):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE qa_cache ADD COLUMN {column} TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS qa_cache_store ON qa_cache (store, ts)")
+            self._conn.commit()
+
+    def get(
+        self,
+        store_name: str,
+        message: str,
+        history: Optional[list[dict]] = None,
+        system_prompt: Optional[str] = None,
+        thinking_budget: Optional[int] = None
+    ) -> Optional[ChatResponse]:
+        """
+        Find a cached response for an exact repeat of a question.
+
+        Args:
+            store_name: The full store name the query targets.
+            message: The user's question.
+            history: The conversation history sent with the question.
+            system_prompt: The system prompt the question is answered under.
+            thinking_budget: The thinking budget the question is answered with.
+
+        Returns:
+            The cached ChatResponse, or None on a miss.
+        """
+        key = _exact_key(message, _context_digest(history, system_prompt, thinking_budget))
+        now = time.time()
+        with self._lock:
+            self._load(store_name, now)
+            self._expire(store_name, now)
+            entry = self._exact.get(store_name, {}).get(key)
+            if entry is None:
+                return None
+            entry.last_used = now
+            return entry.response
+
+    def lookup(
+        self,
+        store_name: str,
+        embedding,
+        history: Optional[list[dict]] = None,
+        system_prompt: Optional[str] = None,
+        thinking_budget: Optional[int] = None
+    ) -> Optional[ChatResponse]:
+        """
+        Find a cached response for a query embedding.
+
+        Args:
+            store_name: The full store name the query targets.
+            embedding: The query embedding (any float sequence).
+            history: The conversation history sent with the question.
+            system_prompt: The system prompt the question is answered under.
+            thinking_budget: The thinking budget the question is answered with.
+
+        Returns:
+            The cached ChatResponse, or None on a miss.
+        """
+        query = _normalize(embedding)
+        context = _context_digest(history, system_prompt, thinking_budget)
+        now = time.time()
+        with self._lock:
+            self._load(store_name, now)
+            self._expire(store_name, now)
+            entries = self._entries.get(store_name)
+            if not entries or self._matrices[store_name].shape[1] != query.shape[0]:
+                return None
+
+            # The matrix rows are pre-normalized, so one dot product gives
+            # cosine similarity against every cached query
+            similarities = self._matrices[store_name] @ query
+            similarities[[e.context != context for e in entries]] = -1.0
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            entry = entries[best]
+            entry.last_used = now
+            return entry.response
+
+    def add(
+        self,
+        store_name: str,
+        embedding,
+        response: ChatResponse,
+        message: str,
+        history: Optional[list[dict]] = None,
+        system_prompt: Optional[str] = None,
+        thinking_budget: Optional[int] = None
+    ) -> None:
+        """
+        Cache a response for a question.
+
+        Args:
+            store_name: The full store name the query targeted.
+            embedding: The query embedding (any float sequence).
+            response: The response to cache.
+            message: The user's question.
+            history: The conversation history sent with the question.
+            system_prompt: The system prompt the question was answered under.
+            thinking_budget: The thinking budget the question was answered with.
+        """
+        now = time.time()
+        context = _context_digest(history, system_prompt, thinking_budget)
+        entry = _CacheEntry(
+            vector=_normalize(embedding),
+            response=response,
+            created=now,
+            last_used=now,
+            key=_exact_key(message, context),
+            context=context,
+        )
+        with self._lock:
+            self._load(store_name, now)
+            self._expire(store_name, now)
+            entries = self._entries.setdefault(store_name, [])
+            if entries and entries[0].vector.shape != entry.vector.shape:
+                # The embedding dimension changed; old vectors can't be compared
+                entries.clear()
+            if len(entries) >= self.max_entries:
+                entries.remove(min(entries, key=lambda e: e.last_used))
+            entries.append(entry)
+            self._rebuild(store_name)
+            if self._conn:
+                self._conn.execute(
+                    "INSERT INTO qa_cache (store, emb, resp, citations, grounding, thinking, "
+                    "ts, key, context, model, dim) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        store_name,
+                        entry.vector.tobytes(),
+                        response.text,
+                        json.dumps(response.citations),
+                        json.dumps(response.grounding),
+                        response.thinking,
+                        now,
+                        entry.key,
+                        entry.context,
+                        self.embedding_model,
+                        len(entry.vector),
+                    ),
+                )
+                self._conn.commit()
+
+    def invalidate(self, store_name: Optional[str] = None) -> None:
+        """
+        Drop cached responses.
+
+        Args:
+            store_name: Store to clear. If None, clears every store.
+        """
+        with self._lock:
+            if store_name is None:
+                self._entries.clear()
+                self._matrices.clear()
+                self._exact.clear()
+                if self._conn:
+                    self._conn.execute("DELETE FROM qa_cache")
+            else:
+                self._entries.pop(store_name, None)
+                self._matrices.pop(store_name, None)
+                self._exact.pop(store_name, None)
+                if self._conn:
+                    self._conn.execute("DELETE FROM qa_cache WHERE store = ?", (store_name,))
+            if self._conn:
+                self._conn.commit()
+
+    def _load(self, store_name: str, now: float) -> None:
+        """Load a store's persisted entries once. Caller must hold the lock."""
+        if not self._conn or store_name in self._loaded:
+            return
+        self._loaded.add(store_name)
+
+        # Prune stale rows, then keep the newest max_entries from this
+        # embedding model with the newest row's dimension
+        self._conn.execute(
+            "DELETE FROM qa_cache WHERE store = ? AND ts <= ?",
+            (store_name, now - self.ttl),
+        )
+        self._conn.commit()
+        newest = self._conn.execute(
+            "SELECT dim FROM qa_cache WHERE store = ? AND model = ? ORDER BY ts DESC LIMIT 1",
+            (store_name, self.embedding_model),
+        ).fetchone()
+        if not newest:
+            return
+        rows = self._conn.execute(
+            "SELECT emb, resp, citations, grounding, thinking, ts, key, context FROM qa_cache "
+            "WHERE store = ? AND model = ? AND dim = ? ORDER BY ts DESC LIMIT ?",
+            (store_name, self.embedding_model, newest[0], self.max_entries),
+        ).fetchall()
+
+        self._entries[store_name] = [
+            _CacheEntry(
+                vector=np.frombuffer(emb, dtype=np.float32),
+                response=ChatResponse(
+                    text=resp,
+                    citations=json.loads(citations),
+                    grounding=json.loads(grounding),
+                    thinking=thinking,
+                ),
+                created=ts,
+                last_used=ts,
+                key=key or "",
+                context=context or "",
+            )
+            for emb, resp, citations, grounding, thinking, ts, key, context in reversed(rows)
+        ]
+        self._rebuild(store_name)
+
+    def _expire(self, store_name: str, now: float) -> None:
+        """Remove stale entries for a store. Caller must hold the lock."""
+        entries = self._entries.get(store_name)
+        if not entries:
+            return
+        fresh = [e for e in entries if now - e.created < self.ttl]
+        if len(fresh) != len(entries):
+            self._entries[store_name] = fresh
+            self._rebuild(store_name)
+
+    def _rebuild(self, store_name: str) -> None:
+        """Restack a store's embedding matrix and exact index. Caller must hold the lock."""
+        entries = self._entries.get(store_name)
+        if entries:
+            self._matrices[store_name] = np.vstack([e.vector for e in entries])
+            self._exact[store_name] = {e.key: e for e in entries if e.key}
+        else:
+            self._entries.pop(store_name, None)
+            self._matrices.pop(store_name, None)
+            self._exact.pop(store_name, None)
+
+
+def _normalize(embedding) -> np.ndarray:
+    """Convert an embedding to a unit-length float32 vector."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@lru_cache(maxsize=64)
+def _hash_prompt(system_prompt: Optional[str]) -> Optional[str]:
+    """Hash a system prompt once per distinct string (prompts run to several KB)."""
+    if system_prompt is None:
+        return None
+    return hashlib.blake2b(system_prompt.encode(), digest_size=16).hexdigest()
+
+
+def _context_digest(
+    history: Optional[list[dict]],
+    system_prompt: Optional[str] = None,
+    thinking_budget: Optional[int] = None
+) -> str:
+    """Hash the system prompt, thinking budget, and last user/model exchange of a history."""
+    turns = [
+        (m["role"], m["content"])
+        for m in history or []
+        if m["role"] in ("user", "model")
+    ][-2:]
+    return hashlib.sha1(json.dumps([_hash_prompt(system_prompt), thinking_budget, turns]).encode()).hexdigest()
+
+
+def _exact_key(message: str, context: str) -> str:
+    """Hash a case- and whitespace-normalized question with its context."""
+    normalized = re.sub(r"\s+", " ", message.strip().lower())
+    return hashlib.sha1(f"{context}\0{normalized}".encode()).hexdigest()
+
+
+class UploadRegistry:
+    """
+    Record of document content already indexed in each deal room.
+
+    Keyed by (store, SHA-256 of the file bytes), so re-uploading the same
+    document under a different filename can skip the upload and the
+    server-side indexing entirely. Safe to share between threads.
+
+    Usage:
+        registry = UploadRegistry("cache.db")
+        ai = DealRoomAI(api_key="your-key", upload_registry=registry)
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the registry.
+
+        Args:
+            path: SQLite database file. May be shared with SemanticCache.
+        """
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploaded_hashes ("
+            "store TEXT, sha256 TEXT, filename TEXT, ts REAL, "
+            "PRIMARY KEY (store, sha256))"
+        )
+        self._conn.commit()
+
+    def contains(self, store_name: str, sha256: str) -> bool:
+        """Return True if content with this hash is indexed in the store."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM uploaded_hashes WHERE store = ? AND sha256 = ?",
+                (store_name, sha256),
+            ).fetchone()
+        return row is not None
+
+    def add(self, store_name: str, sha256: str, filename: str) -> None:
+        """Record that content with this hash was indexed in the store."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO uploaded_hashes VALUES (?, ?, ?, ?)",
+                (store_name, sha256, filename, time.time()),
+            )
+            self._conn.commit()
+
+    def prune(self, store_name: str, filenames: set[str]) -> int:
+        """
+        Drop a store's records whose filename is not in the given set.
+
+        Args:
+            store_name: The full store name.
+            filenames: Display names of the documents currently in the store.
+
+        Returns:
+            Number of records dropped.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT sha256, filename FROM uploaded_hashes WHERE store = ?",
+                (store_name,),
+            ).fetchall()
+            stale = [(store_name, sha256) for sha256, filename in rows if filename not in filenames]
+            self._conn.executemany(
+                "DELETE FROM uploaded_hashes WHERE store = ? AND sha256 = ?", stale
+            )
+            self._conn.commit()
+        return len(stale)
+
+    def forget_store(self, store_name: str) -> None:
+        """Drop every record for a store (e.g., after it is deleted)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM uploaded_hashes WHERE store = ?", (store_name,))
+            self._conn.commit()
+
+
+class ChatHistory:
+    """
+    Chat transcripts for each deal room, persisted to SQLite.
+
+    Lets a conversation survive browser refreshes and server restarts, so
+    users do not re-ask (and re-pay for) questions they already asked.
+    Messages are stored as the JSON-serializable dicts the UI keeps in
+    session state, one append-only row each, so several sessions with the
+    same room open add to the transcript without overwriting each other.
+    Safe to share between threads.
+
+    Usage:
+        history = ChatHistory("cache.db")
+        messages = history.load(store_name)
+        history.append(store_name, [question, answer])
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the history store.
+
+        Args:
+            path: SQLite database file. May be shared with SemanticCache.
+        """
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_messages ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, store TEXT, message TEXT, ts REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chat_messages_store ON chat_messages (store, seq)")
+        self._conn.commit()
+
+    def load(self, store_name: str, limit: Optional[int] = None, after: int = 0) -> list[dict]:
+        """
+        Return a store's saved messages, oldest first.
+
+        Args:
+            store_name: The full store name.
+            limit: Return only the newest this many messages. None = all.
+            after: Only return messages saved after this sequence number
+                   (see last_seq()).
+
+        Returns:
+            List of message dicts, or an empty list.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message FROM chat_messages WHERE store = ? AND seq > ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (store_name, after, -1 if limit is None else limit),
+            ).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def append(self, store_name: str, messages: list[dict]) -> None:
+        """Add messages (e.g., a question and its answer) to a store's transcript."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO chat_messages (store, message, ts) VALUES (?, ?, ?)",
+                [(store_name, json.dumps(m), now) for m in messages],
+            )
+            self._conn.commit()
+
+    def last_seq(self, store_name: str) -> int:
+        """Return the sequence number of a store's newest message (0 if none)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(seq) FROM chat_messages WHERE store = ?", (store_name,)
+            ).fetchone()
+        return row[0] or 0
+
+    def forget_store(self, store_name: str) -> None:
+        """Drop a store's saved messages (e.g., after it is deleted)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM chat_messages WHERE store = ?", (store_name,))
+            self._conn.commit()